@@ -0,0 +1,54 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from user_auth import authenticate, create_user, AuthError
+from workers import run_in_background
+
+
+class AuthService(QObject):
+    """
+    Вход и регистрация без блокировки интерфейса: bcrypt выполняется в пуле потоков,
+    результат приходит сигналами в поток интерфейса.
+    """
+
+    login_succeeded = pyqtSignal(int, str)   # id пользователя, роль
+    login_failed = pyqtSignal(str)
+    registration_succeeded = pyqtSignal(int)  # id нового пользователя
+    registration_failed = pyqtSignal(str)
+
+    def __init__(self, db, parent=None, rounds=None):
+        super().__init__(parent)
+        self.db = db
+        self.rounds = rounds
+        self._task = None  # Сигналы текущей фоновой задачи
+
+    def is_busy(self):
+        return self._task is not None
+
+    def login(self, username, password):
+        self._task = run_in_background(authenticate, self.db, username, password, self.rounds,
+                                       on_finished=self._on_login_finished, on_failed=self._on_login_failed)
+
+    def register(self, username, password, role):
+        self._task = run_in_background(create_user, self.db, username, password, role, self.rounds,
+                                       on_finished=self._on_registration_finished,
+                                       on_failed=self._on_registration_failed)
+
+    def _on_login_finished(self, result):
+        self._task = None
+        user_id, role = result
+        self.login_succeeded.emit(user_id, role)
+
+    def _on_login_failed(self, error):
+        self._task = None
+        if isinstance(error, AuthError):
+            self.login_failed.emit(str(error))
+        else:
+            self.login_failed.emit(f"Ошибка входа: {error}")
+
+    def _on_registration_finished(self, user_id):
+        self._task = None
+        self.registration_succeeded.emit(user_id)
+
+    def _on_registration_failed(self, error):
+        self._task = None
+        self.registration_failed.emit(f"Ошибка при регистрации: {error}")
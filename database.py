@@ -1,98 +1,798 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 
-class Database:
-    def __init__(self, db_name="store.db"):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)  # Поддержка многопоточности
-        self.create_tables()
+from product_catalog import ProductCatalog, CATALOG_VERSION_KEY
+from startup_trace import trace
 
-    def create_tables(self):
-        with self.conn:
-            # Таблица пользователей
-            self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE,
-                password TEXT,
-                role TEXT CHECK(role IN ('admin', 'user')) NOT NULL
-            )
-            """)
+# Профили производительности SQLite (имя -> значения PRAGMA).
+# "default" - WAL: чтения (экспорт, отчёты, таблица заказов) не блокируют запись заказов и не ждут её.
+# "safe" - классический журнал отката для баз на сетевых дисках, где WAL не поддерживается.
+# Профиль выбирается в main.py (--profile или переменная окружения STORE_DB_PROFILE).
+PERFORMANCE_PROFILES = {
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",        # В режиме WAL fsync только при контрольной точке
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,       # Отрицательное значение - размер в КиБ (64 МиБ)
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
 
-            # Таблица заказов
-            self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                order_number TEXT,
-                status TEXT DEFAULT 'ожидание',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,  -- Добавлено время создания заказа
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-            """)
+# Ограничение числа параметров в одном запросе SQLite (SQLITE_MAX_VARIABLE_NUMBER в старых сборках - 999)
+ID_CHUNK_SIZE = 500
 
-            # Таблица позиций заказа
-            self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS order_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER,
-                price REAL,
-                FOREIGN KEY(order_id) REFERENCES orders(id),
-                FOREIGN KEY(product_id) REFERENCES products(id)
-            )
-            """)
+# Сколько последних записей журнала изменений заказов хранить при очистке
+ORDER_CHANGES_KEEP = 10000
 
-            # Таблица товаров
-            self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                price REAL,
-                quantity INTEGER DEFAULT 0
-            )
-            """)
+# Версия набора индексов: увеличивается при любом изменении INDEXES,
+# тогда при следующем запуске весь набор пересоздаётся
+INDEX_SET_VERSION = 3
 
-    def query(self, query, params=()):
-        with self.conn:
-            cursor = self.conn.execute(query, params)
-            self.conn.commit()
-            return cursor
+# Вторичные индексы для частых запросов (имя -> DDL)
+INDEXES = {
+    # Позиции заказа (EditOrderDialog, edit_order, журнал изменений)
+    "idx_order_items_order_id": "CREATE INDEX idx_order_items_order_id ON order_items (order_id)",
+    # Заказы с данным товаром (переименование товара, отчёты)
+    "idx_order_items_product_id": "CREATE INDEX idx_order_items_product_id ON order_items (product_id)",
+    # Заказы пользователя в порядке таблицы заказов (WHERE users.id = ?)
+    "idx_orders_user_created": "CREATE INDEX idx_orders_user_created ON orders (user_id, created_at, id)",
+    # Фильтры status = 'завершено' в экспорте
+    "idx_orders_status": "CREATE INDEX idx_orders_status ON orders (status)",
+    # Поиск заказа по номеру; уникальность защищает от повторной выдачи номера
+    "idx_orders_order_number": "CREATE UNIQUE INDEX idx_orders_order_number ON orders (order_number)",
+    # Постраничная загрузка таблицы заказов по ключу (created_at, id)
+    "idx_orders_created_at": "CREATE INDEX idx_orders_created_at ON orders (created_at, id)",
+    # Артикул товара - ключ импорта прайс-листов (ON CONFLICT); товары без артикула не ограничиваются
+    "idx_products_sku": "CREATE UNIQUE INDEX idx_products_sku ON products (sku) WHERE sku IS NOT NULL",
+}
+
+# Частые запросы, которые не должны приводить к полному просмотру таблицы (название -> запрос, параметры)
+HOT_QUERIES = {
+    "позиции заказа": (
+        "SELECT product_id, quantity FROM order_items WHERE order_id = ?", (0,)),
+    "заказы с товаром": (
+        "SELECT DISTINCT order_id FROM order_items WHERE product_id = ?", (0,)),
+    "поиск заказа по номеру": (
+        "SELECT id FROM orders WHERE order_number = ?", ("",)),
+    "порция заказов": (
+        "SELECT created_at, id FROM orders WHERE created_at IS NOT NULL AND (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?", ("", 0, 1)),
+    "порция заказов пользователя": (
+        "SELECT created_at, id FROM orders WHERE created_at IS NOT NULL AND (created_at, id) < (?, ?) "
+        "AND user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?", ("", 0, 0, 1)),
+    "новые заказы для выгрузки": (
+        "SELECT id FROM orders WHERE created_at IS NOT NULL AND (created_at, id) <= (?, ?) "
+        "AND (created_at, id) > (?, ?)", ("", 0, "", 0)),
+    "товары по артикулам при импорте": (
+        "SELECT sku, name, price, quantity, reserved FROM products WHERE sku IN (?, ?)", ("", "")),
+}
+
+
+# Сводные таблицы продаж по завершённым заказам (таблица -> ключевой столбец, выражение ключа).
+# Строки без времени создания попадают в день/месяц '' (NULL в ключе не позволил бы обновлять строку по ключу).
+SALES_ROLLUPS = {
+    "sales_daily": ("day", "COALESCE(date(created_at), '')"),
+    "sales_monthly": ("month", "COALESCE(strftime('%Y-%m', created_at), '')"),
+    "sales_by_product": ("product_id", "product_id"),
+}
+
+# Условие "заказ учитывается в продажах"
+COMPLETED_STATUS = "завершено"
+# Отменённый заказ не удерживает товар
+CANCELLED_STATUS = "отменено"
+
+# Состояние товара заказа на складе (orders.stock_state, см. stock.py):
+# reserved - товар зарезервирован (products.reserved), committed - списан со склада, released - не удерживается
+STOCK_RESERVED, STOCK_COMMITTED, STOCK_RELEASED = "reserved", "committed", "released"
+
+
+def sales_rollup_delta(source, sign):
+    """
+    SQL, прибавляющий (sign=1) или вычитающий (sign=-1) строки заказов к сводным таблицам продаж.
+    :param source: SELECT со столбцами created_at, product_id, price, quantity.
+    """
+    statements = []
+    for table, (key, expression) in SALES_ROLLUPS.items():
+        statements.append(f"""
+            INSERT INTO {table} ({key}, income, quantity, lines)
+            SELECT {expression}, {sign} * SUM(price), {sign} * SUM(quantity), {sign} * COUNT(*)
+            FROM ({source}) WHERE true GROUP BY 1
+            ON CONFLICT ({key}) DO UPDATE SET
+                income = income + excluded.income,
+                quantity = quantity + excluded.quantity,
+                lines = lines + excluded.lines;""")
+        if sign < 0:
+            # Строка, в которой не осталось ни одной позиции заказа, удаляется
+            statements.append(f"""
+            DELETE FROM {table} WHERE lines = 0 AND {key} IN (SELECT {expression} FROM ({source}));""")
+    return "\n".join(statements)
+
+
+def chunked(values, size=ID_CHUNK_SIZE):
+    """ Делит список значений на части для запросов вида IN (?, ?, ...). """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def placeholders(values):
+    """ Возвращает строку "?, ?, ..." по числу значений. """
+    return ", ".join("?" * len(values))
+
+
+def execute_script(conn, script):
+    """
+    Выполняет несколько SQL-команд по одной.
+    В отличие от executescript не делает COMMIT, поэтому подходит для шагов миграции внутри транзакции.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+
+class UnitOfWork:
+    """
+    Операции внутри Database.transaction(): все команды и чтения идут через соединение записи,
+    поэтому чтения видят ещё не зафиксированные изменения этой же транзакции.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=()):
+        return self.conn.execute(query, params)
+
+    def executemany(self, query, seq_of_params):
+        return self.conn.executemany(query, seq_of_params)
 
     def fetch_all(self, query, params=()):
-        cursor = self.query(query, params)
-        return cursor.fetchall()
+        return self.conn.execute(query, params).fetchall()
 
     def fetch_one(self, query, params=()):
-        cursor = self.query(query, params)
-        return cursor.fetchone()
+        return self.conn.execute(query, params).fetchone()
+
+
+class Database:
+    # Шаги миграции схемы по порядку: шаг с номером N (с единицы) переводит базу на версию N.
+    # Новые шаги добавляются только в конец списка.
+    MIGRATIONS = (
+        "create_tables",
+        "migrate_orders_created_at",
+        "migrate_order_number_sequence",
+        "migrate_sales_rollups",
+        "migrate_export_watermarks",
+        "migrate_stock_reservations",
+        "migrate_product_catalog_version",
+        "migrate_product_search",
+        "migrate_product_sku",
+        "migrate_products_journal_delete",
+    )
+
+    def __init__(self, db_name="store.db", profile="default"):
+        self.db_name = db_name
+        self.pragmas = PERFORMANCE_PROFILES[profile]
 
-    def migrate_orders_table(self):
-        """ Миграция данных для добавления столбца created_at в таблицу orders. """
-        # Создаем новую таблицу с нужной структурой
+        # Соединение для записи (и для чтения внутри изменений)
+        self.conn = self._connect()
+        self.conn.execute(f"PRAGMA journal_mode = {self.pragmas.get('journal_mode', 'DELETE')}")
+        self._readers = threading.local()
+        self._reader_connections = []
+        self._readers_lock = threading.Lock()
+        # Соединение записи используется из нескольких потоков по очереди;
+        # поток, открывший транзакцию, владеет им до её завершения
+        self._write_lock = threading.RLock()
+        self._transaction_owner = None
+        self._transaction_depth = 0
+        # Кэш списка товаров, общий для всех окон
+        self.catalog = ProductCatalog(self)
+
+        with trace.phase("миграции"):
+            self.migrate()
+        # Полнотекстовый индекс названий товаров (нет, если SQLite собран без FTS5)
+        self.product_search = self.fetch_one(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'") is not None
+        with trace.phase("индексы"):
+            self.ensure_indexes()
+        with trace.phase("проверка планов запросов"):
+            self.verify_query_plans()
+        with trace.phase("очистка журнала изменений"):
+            self.prune_order_changes()
+
+    def _connect(self):
+        # isolation_level=None: транзакции открываются только явно (transaction()),
+        # отдельные команды вне транзакции фиксируются сразу
+        conn = sqlite3.connect(self.db_name, check_same_thread=False,  # Поддержка многопоточности
+                               isolation_level=None)
+        for name, value in self.pragmas.items():
+            if name != "journal_mode":
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def reader(self):
+        """
+        Возвращает соединение только для чтения, своё для каждого потока, поэтому чтение
+        не видит незафиксированную транзакцию, открытую другим потоком на соединении записи.
+        В режиме WAL чтение идёт по снимку базы и не мешает записи. С журналом отката
+        (профиль "safe") читатель на время запроса держит разделяемую блокировку,
+        и фиксация записи ждёт его завершения (не дольше busy_timeout).
+        """
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON")
+            self._readers.conn = conn
+            with self._readers_lock:
+                self._reader_connections.append(conn)
+        return conn
+
+    def close(self):
+        """ Закрывает все соединения с базой данных. """
+        with self._readers_lock:
+            for conn in self._reader_connections:
+                conn.close()
+            self._reader_connections = []
+        self._readers = threading.local()
+        self.conn.close()
+
+    def migrate(self):
+        """
+        Применяет недостающие шаги миграции из MIGRATIONS.
+        Версия схемы хранится в PRAGMA user_version; каждый шаг выполняется
+        в отдельной транзакции вместе с записью новой версии, поэтому прерванная
+        миграция не оставляет базу в промежуточном состоянии.
+        """
+        if self.schema_version() >= len(self.MIGRATIONS):
+            return
+
+        for version, step in enumerate(self.MIGRATIONS, start=1):
+            with self.transaction():
+                # Версию перечитываем под блокировкой: шаг мог уже выполнить другой клиент
+                if self.schema_version() < version:
+                    getattr(self, step)()
+                    self.conn.execute(f"PRAGMA user_version = {version}")
+
+    def schema_version(self):
+        """ Возвращает версию схемы базы данных (PRAGMA user_version). """
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def create_tables(self):
+        """ Шаг миграции 1: базовые таблицы и журнал изменений заказов. """
+        # Таблица пользователей
         self.conn.execute("""
-        CREATE TABLE IF NOT EXISTS new_orders (
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            role TEXT CHECK(role IN ('admin', 'user')) NOT NULL
+        )
+        """)
+
+        # Таблица заказов
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             order_number TEXT,
             status TEXT DEFAULT 'ожидание',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,  -- Новый столбец
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,  -- Добавлено время создания заказа
             FOREIGN KEY(user_id) REFERENCES users(id)
         )
         """)
 
-        # Переносим данные из старой таблицы в новую
+        # Таблица позиций заказа
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER,
+            price REAL,
+            FOREIGN KEY(order_id) REFERENCES orders(id),
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )
+        """)
+
+        # Таблица товаров
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            price REAL,
+            quantity INTEGER DEFAULT 0
+        )
+        """)
+
+        # Служебные параметры схемы (например, версия набора индексов)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+
+        # Журнал изменений заказов: триггеры записывают id каждого изменённого заказа,
+        # чтобы окно могло перечитать только эти заказы, а не всю таблицу
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL
+        )
+        """)
+
+        execute_script(self.conn, """
+        CREATE TRIGGER IF NOT EXISTS orders_journal_insert AFTER INSERT ON orders
+        BEGIN
+            INSERT INTO order_changes (order_id) VALUES (NEW.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS orders_journal_update AFTER UPDATE ON orders
+        BEGIN
+            INSERT INTO order_changes (order_id) VALUES (NEW.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS orders_journal_delete AFTER DELETE ON orders
+        BEGIN
+            INSERT INTO order_changes (order_id) VALUES (OLD.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS order_items_journal_insert AFTER INSERT ON order_items
+        BEGIN
+            INSERT INTO order_changes (order_id) VALUES (NEW.order_id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS order_items_journal_update AFTER UPDATE ON order_items
+        BEGIN
+            INSERT INTO order_changes (order_id) VALUES (NEW.order_id);
+            INSERT INTO order_changes (order_id) SELECT OLD.order_id WHERE OLD.order_id IS NOT NEW.order_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS order_items_journal_delete AFTER DELETE ON order_items
+        BEGIN
+            INSERT INTO order_changes (order_id) VALUES (OLD.order_id);
+        END;
+
+        -- Название товара выводится в строках заказов, поэтому его смена затрагивает все заказы с этим товаром
+        CREATE TRIGGER IF NOT EXISTS products_journal_rename AFTER UPDATE OF name ON products
+        WHEN OLD.name IS NOT NEW.name
+        BEGIN
+            INSERT INTO order_changes (order_id)
+            SELECT DISTINCT order_id FROM order_items WHERE product_id = NEW.id;
+        END;
+        """)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Единица работы: все изменения внутри блока фиксируются одним COMMIT
+        или целиком откатываются при исключении.
+
+            with db.transaction() as tx:
+                order_id = tx.execute("INSERT INTO orders ...", params).lastrowid
+                tx.executemany("INSERT INTO order_items ...", rows)
+
+        BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому транзакция не упадёт
+        посередине из-за другого клиента. Вложенный вызов выполняется в точке сохранения
+        (SAVEPOINT) внешней транзакции.
+        """
+        with self._write_lock:
+            depth = self._transaction_depth
+            savepoint = f"unit_of_work_{depth}"
+            self.conn.execute("BEGIN IMMEDIATE" if depth == 0 else f"SAVEPOINT {savepoint}")
+            self._transaction_owner = threading.get_ident()
+            self._transaction_depth += 1
+            try:
+                yield UnitOfWork(self.conn)
+                self.conn.execute("COMMIT" if depth == 0 else f"RELEASE {savepoint}")
+            except BaseException:
+                if depth == 0:
+                    if self.conn.in_transaction:
+                        self.conn.execute("ROLLBACK")
+                else:
+                    self.conn.execute(f"ROLLBACK TO {savepoint}")
+                    self.conn.execute(f"RELEASE {savepoint}")
+                raise
+            finally:
+                self._transaction_depth = depth
+                if depth == 0:
+                    self._transaction_owner = None
+
+    def owns_transaction(self):
+        """ Открыта ли транзакция (transaction()) в текущем потоке. """
+        return self._transaction_owner == threading.get_ident()
+
+    def _read_connection(self):
+        # Внутри своей транзакции читаем через соединение записи, чтобы видеть незафиксированные изменения
+        if self.owns_transaction():
+            return self.conn
+        return self.reader()
+
+    def query(self, query, params=()):
+        """
+        Выполняет команду через соединение записи.
+        Вне transaction() команда фиксируется сразу; внутри - вместе со всей транзакцией.
+        """
+        with self._write_lock:
+            return self.conn.execute(query, params)
+
+    def fetch_all(self, query, params=()):
+        return self._read_connection().execute(query, params).fetchall()
+
+    def fetch_one(self, query, params=()):
+        return self._read_connection().execute(query, params).fetchone()
+
+    def iterate(self, query, params=(), batch_size=1000):
+        """ Отдаёт строки результата по одной, читая их порциями, без загрузки всего результата в память. """
+        cursor = self._read_connection().execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()  # Курсор освобождается и при досрочной остановке (например, отмене экспорта)
+
+    def next_sequence_value(self, name):
+        """
+        Выделяет следующее значение счётчика из таблицы sequences.
+        Выполняется в транзакции записи (или в точке сохранения текущей транзакции),
+        поэтому два клиента одной базы не могут получить одно и то же значение.
+        """
+        with self.transaction() as tx:
+            tx.execute("UPDATE sequences SET value = value + 1 WHERE name = ?", (name,))
+            return tx.fetch_one("SELECT value FROM sequences WHERE name = ?", (name,))[0]
+
+    def get_meta(self, key, default=None):
+        """ Возвращает служебный параметр схемы из schema_meta. """
+        row = self.fetch_one("SELECT value FROM schema_meta WHERE key = ?", (key,))
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """ Сохраняет служебный параметр схемы в schema_meta. """
+        self.query("INSERT OR REPLACE INTO schema_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def ensure_indexes(self):
+        """
+        Создаёт недостающие индексы из INDEXES.
+        Если сохранённая версия набора отличается от INDEX_SET_VERSION, все индексы набора пересоздаются.
+        """
+        version = int(self.get_meta("index_set_version", 0))
+        existing = {name for (name,) in self.fetch_all("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        if version == INDEX_SET_VERSION and existing.issuperset(INDEXES):
+            return
+
+        with self.transaction():
+            for name, sql in INDEXES.items():
+                if version != INDEX_SET_VERSION and name in existing:
+                    self.conn.execute(f"DROP INDEX {name}")
+                    existing.discard(name)
+                if name not in existing:
+                    self.conn.execute(sql)
+            self.conn.execute("INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('index_set_version', ?)",
+                              (str(INDEX_SET_VERSION),))
+
+    def verify_query_plans(self):
+        """
+        Проверяет через EXPLAIN QUERY PLAN, что частые запросы (HOT_QUERIES) используют индексы.
+        Планы строятся на копии схемы в памяти без данных и статистики: иначе на маленькой базе
+        планировщик законно выбирает полный просмотр, и проверка зависела бы от объёма данных.
+        :raises RuntimeError: если какой-либо запрос выполняет полный просмотр таблицы.
+        """
+        # Служебные таблицы виртуальных таблиц (products_fts_data и т. п.) не копируются:
+        # их создаёт сама виртуальная таблица
+        schema = self.conn.execute("""
+            SELECT sql FROM sqlite_master AS item
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+              AND NOT (type = 'table' AND EXISTS (
+                  SELECT 1 FROM sqlite_master AS virtual
+                  WHERE virtual.sql LIKE 'CREATE VIRTUAL TABLE%' AND item.name LIKE virtual.name || '\\_%' ESCAPE '\\'))
+        """).fetchall()
+        plans = sqlite3.connect(":memory:")
+        try:
+            for (sql,) in schema:
+                plans.execute(sql)
+
+            problems = []
+            for title, (sql, params) in HOT_QUERIES.items():
+                for row in plans.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+                    detail = row[-1]
+                    if detail.startswith("SCAN ") and " USING " not in detail:
+                        problems.append(f"{title}: {detail}")
+        finally:
+            plans.close()
+        if problems:
+            raise RuntimeError("Запросы выполняют полный просмотр таблиц:\n" + "\n".join(problems))
+
+    def last_order_key(self):
+        """ Ключ (created_at, id) самого нового заказа со временем создания или None. """
+        row = self.fetch_one("SELECT created_at, id FROM orders WHERE created_at IS NOT NULL "
+                             "ORDER BY created_at DESC, id DESC LIMIT 1")
+        return tuple(row) if row else None
+
+    def export_watermark(self, name):
+        """ Ключ (created_at, id) последнего заказа, выгруженного экспортом name, или None. """
+        row = self.fetch_one("SELECT created_at, order_id FROM export_watermarks WHERE name = ?", (name,))
+        return tuple(row) if row else None
+
+    def set_export_watermark(self, name, key):
+        self.query("""
+        INSERT INTO export_watermarks (name, created_at, order_id) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET created_at = excluded.created_at, order_id = excluded.order_id
+        """, (name,) + tuple(key))
+
+    def last_order_change(self):
+        """ Возвращает номер последней записи журнала изменений заказов. """
+        return self.fetch_one("SELECT COALESCE(MAX(id), 0) FROM order_changes")[0]
+
+    def fetch_order_changes(self, since):
+        """
+        Возвращает изменения заказов после записи журнала since.
+        :return: (номер последней записи, множество id изменённых заказов) или None,
+                 если часть нужных записей уже удалена из журнала и требуется полная перезагрузка.
+        """
+        first_change = self.fetch_one("SELECT MIN(id) FROM order_changes")[0]
+        if first_change is not None and first_change > since + 1:
+            return None
+
+        rows = self.fetch_all("SELECT id, order_id FROM order_changes WHERE id > ? ORDER BY id", (since,))
+        if not rows:
+            return since, set()
+        return rows[-1][0], {order_id for _, order_id in rows}
+
+    def prune_order_changes(self, keep=ORDER_CHANGES_KEEP):
+        """ Удаляет старые записи журнала изменений, оставляя последние keep записей. """
+        self.query("DELETE FROM order_changes WHERE id <= (SELECT MAX(id) FROM order_changes) - ?", (keep,))
+
+    def migrate_orders_created_at(self):
+        """ Шаг миграции 2: столбец created_at в таблице orders баз, созданных до его появления. """
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(orders)")}
+        if "created_at" in columns:
+            return
+
+        # ALTER TABLE ADD COLUMN меняет только описание таблицы и не переписывает строки,
+        # но не допускает DEFAULT CURRENT_TIMESTAMP - время для новых заказов подставляет триггер
+        self.conn.execute("ALTER TABLE orders ADD COLUMN created_at DATETIME")
+        self.conn.execute("""
+        CREATE TRIGGER orders_created_at_default AFTER INSERT ON orders
+        WHEN NEW.created_at IS NULL
+        BEGIN
+            UPDATE orders SET created_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        END
+        """)
+
+    def migrate_order_number_sequence(self):
+        """
+        Шаг миграции 3: счётчик номеров заказов вместо COUNT(*) + 1.
+        Номера, повторно выданные старым способом, заменяются новыми, чтобы
+        на order_number можно было построить уникальный индекс.
+        """
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """)
+
+        last_number = self.conn.execute("""
+        SELECT COALESCE(MAX(CAST(SUBSTR(order_number, 5) AS INTEGER)), 0)
+        FROM orders WHERE order_number LIKE 'ORD-%'
+        """).fetchone()[0]
+
+        # Все повторы номера, кроме самого раннего заказа с этим номером
+        duplicates = self.conn.execute("""
+        SELECT id FROM orders
+        WHERE order_number IS NOT NULL
+          AND id NOT IN (SELECT MIN(id) FROM orders WHERE order_number IS NOT NULL GROUP BY order_number)
+        ORDER BY id
+        """).fetchall()
+        renumbered = [(f"ORD-{last_number + offset}", order_id)
+                      for offset, (order_id,) in enumerate(duplicates, start=1)]
+        self.conn.executemany("UPDATE orders SET order_number = ? WHERE id = ?", renumbered)
+
+        self.conn.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES ('order_number', ?)",
+                          (last_number + len(renumbered),))
+
+    def migrate_sales_rollups(self):
+        """
+        Шаг миграции 4: сводные таблицы продаж по дням, месяцам и товарам.
+        Триггеры поддерживают их при каждом изменении, затрагивающем завершённые заказы
+        (смена статуса или времени заказа, изменение его позиций, удаление),
+        поэтому отчёты читают готовые итоги, а не все позиции заказов.
+        """
+        for table, (key, _) in SALES_ROLLUPS.items():
+            key_type = "INTEGER" if key == "product_id" else "TEXT"
+            self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} {key_type} PRIMARY KEY NOT NULL,
+                income REAL NOT NULL DEFAULT 0,
+                quantity INTEGER NOT NULL DEFAULT 0,
+                lines INTEGER NOT NULL DEFAULT 0  -- Число учтённых позиций заказов
+            )
+            """)
+
+        completed = f"'{COMPLETED_STATUS}'"
+        item_source = ("SELECT orders.created_at AS created_at, {row}.product_id AS product_id, "
+                       "{row}.price AS price, {row}.quantity AS quantity "
+                       f"FROM orders WHERE orders.id = {{row}}.order_id AND orders.status = {completed}")
+        order_source = ("SELECT {row}.created_at AS created_at, product_id, price, quantity "
+                        f"FROM order_items WHERE order_id = {{row}}.id AND {{row}}.status = {completed}")
+
+        execute_script(self.conn, f"""
+        CREATE TRIGGER IF NOT EXISTS order_items_sales_insert AFTER INSERT ON order_items
+        BEGIN
+            {sales_rollup_delta(item_source.format(row="NEW"), 1)}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS order_items_sales_update
+        AFTER UPDATE OF order_id, product_id, quantity, price ON order_items
+        BEGIN
+            {sales_rollup_delta(item_source.format(row="OLD"), -1)}
+            {sales_rollup_delta(item_source.format(row="NEW"), 1)}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS order_items_sales_delete AFTER DELETE ON order_items
+        BEGIN
+            {sales_rollup_delta(item_source.format(row="OLD"), -1)}
+        END;
+
+        -- Заказ стал завершённым или перестал им быть (или у завершённого заказа изменилось время)
+        CREATE TRIGGER IF NOT EXISTS orders_sales_update AFTER UPDATE OF status, created_at ON orders
+        WHEN (OLD.status = {completed} OR NEW.status = {completed})
+         AND (OLD.status IS NOT NEW.status OR OLD.created_at IS NOT NEW.created_at)
+        BEGIN
+            {sales_rollup_delta(order_source.format(row="OLD"), -1)}
+            {sales_rollup_delta(order_source.format(row="NEW"), 1)}
+        END;
+
+        -- Позиции удаляемого заказа (если они удаляются после заказа, их триггер заказ уже не найдёт)
+        CREATE TRIGGER IF NOT EXISTS orders_sales_delete AFTER DELETE ON orders
+        WHEN OLD.status = {completed}
+        BEGIN
+            {sales_rollup_delta(order_source.format(row="OLD"), -1)}
+        END;
+        """)
+
+        # Итоги по уже существующим заказам
+        for table in SALES_ROLLUPS:
+            self.conn.execute(f"DELETE FROM {table}")
+        execute_script(self.conn, sales_rollup_delta(f"""
+            SELECT orders.created_at AS created_at, order_items.product_id AS product_id,
+                   order_items.price AS price, order_items.quantity AS quantity
+            FROM orders JOIN order_items ON order_items.order_id = orders.id
+            WHERE orders.status = {completed}""", 1))
+
+    def migrate_export_watermarks(self):
+        """ Шаг миграции 5: отметки последних выгруженных заказов для инкрементального экспорта. """
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            name TEXT PRIMARY KEY,
+            created_at DATETIME NOT NULL,
+            order_id INTEGER NOT NULL
+        )
+        """)
+
+    def migrate_stock_reservations(self):
+        """
+        Шаг миграции 6: резервирование товара (products.reserved) и состояние товара заказа (orders.stock_state).
+        Раньше товар списывался из quantity сразу при создании заказа. Незавершённые заказы переводятся
+        в резерв: их количество возвращается в quantity и переносится в reserved, поэтому доступный
+        остаток (quantity - reserved) не меняется. Завершённые заказы считаются списанными, отменённые -
+        не удерживающими товар (остаток по ним прежний код не возвращал, и он не возвращается).
+        """
+        product_columns = {row[1] for row in self.conn.execute("PRAGMA table_info(products)")}
+        if "reserved" not in product_columns:
+            self.conn.execute("ALTER TABLE products ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0")
+        order_columns = {row[1] for row in self.conn.execute("PRAGMA table_info(orders)")}
+        if "stock_state" not in order_columns:
+            self.conn.execute(f"ALTER TABLE orders ADD COLUMN stock_state TEXT NOT NULL DEFAULT '{STOCK_RESERVED}'")
+
+        # Новый столбец уже равен reserved: переписываются только завершённые и отменённые заказы (idx_orders_status)
         self.conn.execute("""
-        INSERT INTO new_orders (id, user_id, order_number, status)
-        SELECT id, user_id, order_number, status FROM orders
+        UPDATE orders SET stock_state = CASE status WHEN ? THEN ? ELSE ? END
+        WHERE status IN (?, ?)
+        """, (COMPLETED_STATUS, STOCK_COMMITTED, STOCK_RELEASED, COMPLETED_STATUS, CANCELLED_STATUS))
+
+        held = self.conn.execute("""
+        SELECT order_items.product_id, SUM(order_items.quantity)
+        FROM orders JOIN order_items ON order_items.order_id = orders.id
+        WHERE orders.stock_state = ?
+        GROUP BY order_items.product_id
+        """, (STOCK_RESERVED,)).fetchall()
+        self.conn.executemany("UPDATE products SET quantity = quantity + ?, reserved = reserved + ? WHERE id = ?",
+                              [(quantity, quantity, product_id) for product_id, quantity in held])
+
+    def migrate_product_catalog_version(self):
+        """
+        Шаг миграции 7: версия каталога товаров (см. product_catalog.ProductCatalog).
+        Остатки в каталог не входят, поэтому их изменение версию не увеличивает.
+        """
+        bump = f"""
+            INSERT INTO schema_meta (key, value) VALUES ('{CATALOG_VERSION_KEY}', 1)
+            ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;"""
+        execute_script(self.conn, f"""
+        CREATE TRIGGER IF NOT EXISTS products_catalog_insert AFTER INSERT ON products
+        BEGIN {bump}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_catalog_update AFTER UPDATE OF name, price ON products
+        WHEN OLD.name IS NOT NEW.name OR OLD.price IS NOT NEW.price
+        BEGIN {bump}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_catalog_delete AFTER DELETE ON products
+        BEGIN {bump}
+        END;
+        """)
+        self.conn.execute("INSERT OR IGNORE INTO schema_meta (key, value) VALUES (?, '1')", (CATALOG_VERSION_KEY,))
+
+    def migrate_product_search(self):
+        """
+        Шаг миграции 8: полнотекстовый индекс FTS5 по названиям товаров для поиска при добавлении заказа.
+        Индекс хранит только токены (content='products'), сами названия читаются из products;
+        триггеры поддерживают его при изменении товаров. Если SQLite собран без FTS5, шаг
+        ничего не создаёт и поиск работает через LIKE (см. ProductCatalog.search).
+        """
+        try:
+            self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, content = 'products', content_rowid = 'id', prefix = '2 3'
+            )
+            """)
+        except sqlite3.OperationalError:
+            return
+
+        execute_script(self.conn, """
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        END;
         """)
+        self.conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+    def migrate_product_sku(self):
+        """
+        Шаг миграции 9: артикул товара (products.sku) для импорта прайс-листов (product_import).
+        Уникальность артикула обеспечивает индекс idx_products_sku из INDEXES.
+        """
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(products)")}
+        if "sku" not in columns:
+            self.conn.execute("ALTER TABLE products ADD COLUMN sku TEXT")
 
-        # Удаляем старую таблицу
-        self.conn.execute("DROP TABLE orders")
+    def migrate_products_journal_delete(self):
+        """
+        Шаг миграции 10: удаление товара меняет строки всех заказов с ним (JOIN products),
+        поэтому такие заказы отмечаются в журнале изменений, как и при переименовании товара.
+        """
+        self.conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_journal_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO order_changes (order_id)
+            SELECT DISTINCT order_id FROM order_items WHERE product_id = OLD.id;
+        END
+        """)
 
-        # Переименовываем новую таблицу в orders
-        self.conn.execute("ALTER TABLE new_orders RENAME TO orders")
 
 if __name__ == "__main__":
-    db = Database()
-    db.migrate_orders_table()  # Выполняем миграцию, если необходимо
-    print("Database initialized.")
\ No newline at end of file
+    db = Database()  # Миграции применяются при открытии базы
+    print(f"Database initialized (schema version {db.schema_version()}).")
@@ -1,13 +1,59 @@
-import pandas as pd
-from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QMessageBox
+from PyQt6.QtCore import QDate, pyqtSignal
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog,
+                             QMessageBox, QProgressBar, QComboBox, QDateEdit)
 from database import Database
+from exporters import EXPORTERS, XlsxExporter, export_files
+from reports import report_sheets, order_lines_sheet, REPORT_SHEET_NAMES, ORDER_LINES_SHEET_NAME
+from workers import start_job
 import os
 
+# Имя отметки инкрементального экспорта ("новые заказы с прошлой выгрузки")
+NEW_ORDERS_WATERMARK = "new_orders"
+
+
+def export_report(job, db, filepath, date_from=None, date_to=None, exporter=None):
+    """
+    Фоновая задача экспорта отчёта (см. workers.start_job).
+    :param exporter: формат выгрузки (exporters.Exporter), по умолчанию .xlsx
+    :return: список записанных файлов
+    """
+    return export_files(exporter or XlsxExporter(), filepath, report_sheets(db, date_from, date_to), job)
+
+
+def export_new_orders(job, db, filepath, watermark=NEW_ORDERS_WATERMARK, exporter=None):
+    """
+    Фоновая задача инкрементального экспорта: в файл попадают только заказы, созданные после
+    предыдущей успешной выгрузки. Отметка (ключ последнего выгруженного заказа) сдвигается
+    только после записи файла, поэтому отменённая или неудачная выгрузка повторится целиком.
+    :return: список записанных файлов
+    """
+    after = db.export_watermark(watermark)
+    until = db.last_order_key()  # Заказы, созданные во время выгрузки, войдут в следующую
+    files = export_files(exporter or XlsxExporter(), filepath, [order_lines_sheet(db, after, until)], job)
+    if until is not None and until != after:
+        db.set_export_watermark(watermark, until)
+    return files
+
+
 class ExportToExcelDialog(QDialog):
-    def __init__(self, db):
-        super().__init__()
+    """
+    Немодальное окно экспорта. Отчёт формируется в фоновом потоке, поэтому основное окно
+    остаётся доступным; по окончании испускается export_finished со списком записанных файлов.
+    Кроме .xlsx доступны потоковые CSV, Parquet и Arrow (exporters.EXPORTERS).
+    """
+
+    export_finished = pyqtSignal(str)
+
+    # Режимы экспорта (индексы в списке выбора)
+    MODE_ALL, MODE_PERIOD, MODE_NEW_ORDERS = range(3)
+    MODES = ["Отчёт за всё время", "Отчёт за период", "Новые заказы с прошлой выгрузки"]
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
         self.db = db
-        self.setWindowTitle("Экспорт в Excel")
+        self.job = None  # Текущая фоновая задача экспорта
+        self.filepath = None
+        self.setWindowTitle("Экспорт данных")
         self.setGeometry(300, 300, 400, 200)
         self.setStyleSheet("""
             QWidget { background-color: #D7EAD7; }
@@ -19,109 +65,133 @@ class ExportToExcelDialog(QDialog):
         self.layout = QVBoxLayout()
 
         self.filename_input = QLineEdit()
-        self.layout.addWidget(QLabel("Введите название файла (без .xlsx):"))
+        self.layout.addWidget(QLabel("Введите название файла (без расширения):"))
         self.layout.addWidget(self.filename_input)
 
+        self.format_combobox = QComboBox()
+        self.format_combobox.addItems([exporter.title for exporter in EXPORTERS])
+        self.layout.addWidget(QLabel("Формат:"))
+        self.layout.addWidget(self.format_combobox)
+
+        self.mode_combobox = QComboBox()
+        self.mode_combobox.addItems(self.MODES)
+        self.mode_combobox.currentIndexChanged.connect(self.on_mode_changed)
+        self.layout.addWidget(QLabel("Что экспортировать:"))
+        self.layout.addWidget(self.mode_combobox)
+
+        # Период отчёта (включительно); доступен только в режиме "Отчёт за период"
+        today = QDate.currentDate()
+        self.date_from_input = QDateEdit(today.addDays(-today.day() + 1))
+        self.date_to_input = QDateEdit(today)
+        period_layout = QHBoxLayout()
+        period_layout.addWidget(QLabel("С:"))
+        period_layout.addWidget(self.date_from_input)
+        period_layout.addWidget(QLabel("по:"))
+        period_layout.addWidget(self.date_to_input)
+        for date_input in (self.date_from_input, self.date_to_input):
+            date_input.setCalendarPopup(True)
+            date_input.setDisplayFormat("dd.MM.yyyy")
+        self.layout.addLayout(period_layout)
+        self.on_mode_changed(self.MODE_ALL)
+
         self.export_button = QPushButton("Экспортировать")
         self.export_button.clicked.connect(self.export_to_excel)
         self.layout.addWidget(self.export_button)
 
+        # Ход выполнения: по листам отчёта, в подписи - число записанных строк
+        self.progress_bar = QProgressBar()
+        self.progress_label = QLabel("")
+        self.layout.addWidget(self.progress_bar)
+        self.layout.addWidget(self.progress_label)
+
+        self.cancel_button = QPushButton("Отменить экспорт")
+        self.cancel_button.clicked.connect(self.cancel_export)
+        self.cancel_button.setEnabled(False)
+        self.layout.addWidget(self.cancel_button)
+
         self.setLayout(self.layout)
 
+    def is_running(self):
+        return self.job is not None
+
+    def on_mode_changed(self, mode):
+        for date_input in (self.date_from_input, self.date_to_input):
+            date_input.setEnabled(mode == self.MODE_PERIOD)
+
     def export_to_excel(self):
+        if self.is_running():
+            return
+
         filename = self.filename_input.text().strip()
         if not filename:
             QMessageBox.warning(self, "Ошибка", "Введите название файла.")
             return
 
-        filepath = f"{filename}.xlsx"
+        mode = self.mode_combobox.currentIndex()
+        if mode == self.MODE_PERIOD and self.date_from_input.date() > self.date_to_input.date():
+            QMessageBox.warning(self, "Ошибка", "Начало периода позже его окончания.")
+            return
+
+        exporter = EXPORTERS[self.format_combobox.currentIndex()]
+        filepath = f"{filename}{exporter.extension}"
 
-        # Проверка на существование файла
-        if os.path.exists(filepath):
+        # Проверка на существование файлов (табличные форматы пишут каждый лист в отдельный файл)
+        sheet_names = [ORDER_LINES_SHEET_NAME] if mode == self.MODE_NEW_ORDERS else list(REPORT_SHEET_NAMES)
+        existing = [path for path in exporter.target_paths(filepath, sheet_names) if os.path.exists(path)]
+        if existing:
             reply = QMessageBox.question(self, "Файл существует",
-                                         f"Файл {filepath} уже существует. Перезаписать его?",
+                                         f"Файл {', '.join(existing)} уже существует. Перезаписать его?",
                                          QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
             if reply == QMessageBox.StandardButton.No:
                 return  # Если пользователь не хочет перезаписывать, выходим из функции
 
-        # Получаем данные о завершенных заказах
-        completed_orders = self.db.fetch_all(
-            "SELECT SUM(price) FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE status = 'завершено')")
-        total_income = float(completed_orders[0][0]) if completed_orders and completed_orders[0][0] is not None else 0.0
-
-        sold_products = self.db.fetch_all(
-            "SELECT product_id, SUM(quantity) FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE status = 'завершено') GROUP BY product_id")
-        sold_products_dict = {product[0]: product[1] for product in sold_products}
-
-        # Получаем данные о товарах на складе
-        products_in_stock = self.db.fetch_all("SELECT id, name, quantity FROM products")
-        stock_data = {product[0]: (product[1], product[2]) for product in products_in_stock}
-
-        # Создаем DataFrame для записи в Excel
-        data = {
-            "Общий доход": [f"{total_income:.2f} ₽"],  # Добавляем символ рубля
-            "Продано товаров": [sum(sold_products_dict.values())],
-        }
-
-        # Создаем DataFrame для товаров на складе
-        stock_list = []
-        for product_id, (name, quantity) in stock_data.items():
-            sold_quantity = sold_products_dict.get(product_id, 0)
-            stock_list.append({
-                "Товар": name,
-                "Остаток товара на складе": quantity,
-                "Продано": sold_quantity,
-            })
-
-        stock_df = pd.DataFrame(stock_list)
-
-        # Получаем данные о заказах по месяцам
-        monthly_data = self.db.fetch_all(
-            """
-            SELECT strftime('%Y-%m', orders.created_at) AS month, 
-                   SUM(order_items.price) AS total_income, 
-                   SUM(order_items.quantity) AS total_sold
-            FROM orders
-            JOIN order_items ON orders.id = order_items.order_id
-            WHERE orders.status = 'завершено'
-            GROUP BY month
-            ORDER BY month
-            """
-        )
-
-        # Создаем DataFrame для месячных данных
-        monthly_list = []
-        for month, total_income, total_sold in monthly_data:
-            monthly_list.append({
-                "Месяц": month,
-                "Общий доход": f"{total_income:.2f} ₽",
-                "Продано товаров": total_sold,
-            })
-
-        monthly_df = pd.DataFrame(monthly_list)
-
-        # Записываем данные в Excel
-        try:
-            with pd.ExcelWriter(filepath) as writer:
-                pd.DataFrame(data).to_excel(writer, sheet_name='Общая информация', index=False)
-                stock_df.to_excel(writer, sheet_name='Товары на складе', index=False)
-                monthly_df.to_excel(writer, sheet_name='Данные по месяцам', index=False)
-
-                # Устанавливаем ширину столбцов автоматически
-                for sheet_name in ['Общая информация', 'Товары на складе', 'Данные по месяцам']:
-                    worksheet = writer.sheets[sheet_name]
-                    for column in worksheet.columns:
-                        max_length = 0
-                        column = [cell for cell in column]
-                        for cell in column:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                        adjusted_width = (max_length + 2)  # Добавляем немного пространства
-                        worksheet.column_dimensions[column[0].column_letter].width = adjusted_width
-
-            QMessageBox.information(self, "Успех", f"Данные успешно экспортированы в {filepath}.")
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать данные: {str(e)}")
+        # Записываем данные в фоновом потоке: строки идут из базы прямо в файл
+        self.filepath = filepath
+        self.export_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.progress_bar.setRange(0, 0)
+        self.progress_label.setText("Подготовка отчёта...")
+        if mode == self.MODE_NEW_ORDERS:
+            task, args = export_new_orders, (self.db, filepath)
+        elif mode == self.MODE_PERIOD:
+            task, args = export_report, (self.db, filepath, self.date_from_input.date().toString("yyyy-MM-dd"),
+                                         self.date_to_input.date().toString("yyyy-MM-dd"))
+        else:
+            task, args = export_report, (self.db, filepath)
+        self.job = start_job(task, *args, exporter=exporter,
+                             on_finished=self.on_export_finished, on_failed=self.on_export_failed,
+                             on_progress=self.on_export_progress, on_cancelled=self.on_export_cancelled)
+
+    def cancel_export(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText("Отмена экспорта...")
+
+    def on_export_progress(self, status):
+        self.progress_bar.setRange(0, status.sheet_count)
+        self.progress_bar.setValue(status.sheet - 1)
+        self.progress_label.setText(f"Лист {status.sheet} из {status.sheet_count} ({status.title}): "
+                                    f"прочитано строк {status.rows}")
+
+    def on_export_finished(self, files):
+        self._finish_job()
+        self.progress_bar.setValue(self.progress_bar.maximum())
+        self.progress_label.setText(f"Готово: {', '.join(files)}")
+        self.export_finished.emit(", ".join(files))
+
+    def on_export_failed(self, error):
+        self._finish_job()
+        self.progress_label.setText("")
+        QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать данные: {str(error)}")
+
+    def on_export_cancelled(self):
+        self._finish_job()
+        self.progress_bar.setValue(0)
+        self.progress_label.setText("Экспорт отменён.")
+
+    def _finish_job(self):
+        self.job = None
+        self.export_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setRange(0, 1)
@@ -0,0 +1,221 @@
+# Форматы выгрузки отчётов. Каждый формат получает листы (reports.ReportSheet) и записывает их
+# потоково, не накапливая строки в памяти.
+import csv
+import os
+import tempfile
+from collections import namedtuple
+from itertools import chain, islice
+
+# Сколько первых строк листа используется для подбора ширины столбцов .xlsx.
+# Ширина задаётся до записи строк (так устроен потоковый режим openpyxl), поэтому
+# она вычисляется по началу потока, а остальные строки пишутся без буферизации.
+WIDTH_SAMPLE_ROWS = 1000
+
+# Как часто (в строках) сообщать о ходе экспорта; в этих же точках проверяется отмена
+PROGRESS_ROWS = 5000
+
+# Сколько строк собирается в один пакет (RecordBatch) для Parquet и Arrow
+ARROW_BATCH_ROWS = 65536
+
+# Ход экспорта: номер текущего листа (с 1), число листов, название листа, прочитано строк листа
+ExportProgress = namedtuple("ExportProgress", ["sheet", "sheet_count", "title", "rows"])
+
+
+def format_money(value):
+    return f"{value or 0:.2f} ₽"  # Добавляем символ рубля
+
+
+class ProgressTracker:
+    """ Считает строки листов по мере чтения и сообщает о ходе экспорта функции report(ExportProgress). """
+
+    def __init__(self, sheet_count, report=None):
+        self.sheet_count = sheet_count
+        self.number = 0
+        self.report = report or (lambda status: None)
+
+    def rows(self, sheet):
+        """ Строки листа sheet; исключение из report (например, отмена) прерывает чтение. """
+        self.number += 1
+        self.report(ExportProgress(self.number, self.sheet_count, sheet.title, 0))
+        for count, row in enumerate(sheet.rows, start=1):
+            yield row
+            if count % PROGRESS_ROWS == 0:
+                self.report(ExportProgress(self.number, self.sheet_count, sheet.title, count))
+
+
+class Exporter:
+    """
+    Формат выгрузки. Подкласс задаёт title, extension и реализует write().
+    Форматы с одной таблицей в файле (single_table) пишут каждый лист в отдельный файл
+    <имя>_<sheet.name><расширение>; если лист один - прямо в указанный файл.
+    """
+
+    title = ""
+    extension = ""
+    single_table = False
+
+    def target_paths(self, filepath, sheet_names):
+        """ Пути к файлам выгрузки листов с именами sheet_names. """
+        if not self.single_table or len(sheet_names) == 1:
+            return [filepath]
+        stem, extension = os.path.splitext(filepath)
+        return [f"{stem}_{name}{extension}" for name in sheet_names]
+
+    def write(self, filepath, sheets, progress):
+        """
+        Записывает листы в файл filepath.
+        :param progress: ProgressTracker; строки листа нужно читать через progress.rows(sheet).
+        """
+        raise NotImplementedError
+
+
+class XlsxExporter(Exporter):
+    """ Excel (.xlsx) в потоковом режиме openpyxl (write_only); денежные суммы - с символом рубля. """
+
+    title = "Excel (.xlsx)"
+    extension = ".xlsx"
+
+    def write(self, filepath, sheets, progress):
+        # openpyxl загружается только при первой выгрузке в .xlsx, а не при запуске приложения
+        from openpyxl import Workbook
+        from openpyxl.utils import get_column_letter
+
+        workbook = Workbook(write_only=True)
+        for sheet in sheets:
+            worksheet = workbook.create_sheet(sheet.title)
+            rows = (_format_row(row, sheet.money_columns) for row in progress.rows(sheet))
+
+            # Ширина столбцов по заголовкам и первым строкам потока
+            sample = list(islice(rows, WIDTH_SAMPLE_ROWS))
+            widths = [len(str(header)) for header in sheet.headers]
+            for row in sample:
+                for index, value in enumerate(row):
+                    widths[index] = max(widths[index], len(str(value)))
+            for index, width in enumerate(widths, start=1):
+                worksheet.column_dimensions[get_column_letter(index)].width = width + 2  # Добавляем немного пространства
+
+            worksheet.append(sheet.headers)
+            for row in chain(sample, rows):
+                worksheet.append(row)
+        workbook.save(filepath)
+
+
+class CsvExporter(Exporter):
+    """ CSV (UTF-8, разделитель - запятая) с исходными значениями без форматирования. """
+
+    title = "CSV (.csv)"
+    extension = ".csv"
+    single_table = True
+
+    def write(self, filepath, sheets, progress):
+        with open(filepath, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            for sheet in sheets:
+                writer.writerow(sheet.headers)
+                writer.writerows(progress.rows(sheet))
+
+
+class ArrowExporter(Exporter):
+    """ Arrow IPC (.arrow, формат Feather v2): строки пишутся пакетами по ARROW_BATCH_ROWS. """
+
+    title = "Arrow IPC (.arrow)"
+    extension = ".arrow"
+    single_table = True
+
+    def write(self, filepath, sheets, progress):
+        pa = _import_pyarrow()
+        for sheet in sheets:
+            schema = _arrow_schema(pa, sheet)
+            with pa.ipc.new_file(filepath, schema) as writer:
+                for batch in _arrow_batches(pa, schema, progress.rows(sheet)):
+                    writer.write_batch(batch)
+
+
+class ParquetExporter(Exporter):
+    """ Parquet (.parquet): строки пишутся пакетами по ARROW_BATCH_ROWS. """
+
+    title = "Parquet (.parquet)"
+    extension = ".parquet"
+    single_table = True
+
+    def write(self, filepath, sheets, progress):
+        pa = _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        for sheet in sheets:
+            schema = _arrow_schema(pa, sheet)
+            with pq.ParquetWriter(filepath, schema) as writer:
+                for batch in _arrow_batches(pa, schema, progress.rows(sheet)):
+                    writer.write_batch(batch)
+
+
+# Доступные форматы в порядке показа в окне экспорта
+EXPORTERS = [XlsxExporter(), CsvExporter(), ParquetExporter(), ArrowExporter()]
+
+
+def export_files(exporter, filepath, sheets, job):
+    """
+    Записывает листы в формате exporter. Каждый файл сначала пишется во временный файл рядом
+    с целевым; файлы переименовываются только после успешной записи всех, поэтому при отмене
+    или ошибке существующие файлы не повреждаются, а недописанные удаляются.
+    :param job: workers.Job - отчёт о ходе выполнения и проверка отмены.
+    :return: список путей к записанным файлам
+    """
+    progress = ProgressTracker(len(sheets), job.report)
+    written = []
+    try:
+        paths = exporter.target_paths(filepath, [sheet.name for sheet in sheets])
+        groups = [sheets] if len(paths) == 1 else [[sheet] for sheet in sheets]
+        for path, file_sheets in zip(paths, groups):
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, temp_path = tempfile.mkstemp(suffix=exporter.extension, dir=directory)
+            os.close(fd)
+            written.append((temp_path, path))
+            exporter.write(temp_path, file_sheets, progress)
+        job.check()
+        for temp_path, path in written:
+            os.replace(temp_path, path)
+    except BaseException:
+        for temp_path, _ in written:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    finally:
+        # Незаконченные курсоры закрываются сразу, а не при сборке мусора
+        for sheet in sheets:
+            close = getattr(sheet.rows, "close", None)
+            if close is not None:
+                close()
+    return [path for _, path in written]
+
+
+def _format_row(row, money_columns):
+    if not money_columns:
+        return row
+    return [format_money(value) if index in money_columns else value for index, value in enumerate(row)]
+
+
+def _import_pyarrow():
+    # pyarrow нужен только для Parquet и Arrow, поэтому загружается при первой такой выгрузке
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError("Для экспорта в Parquet и Arrow установите пакет pyarrow.") from None
+    return pyarrow
+
+
+def _arrow_schema(pa, sheet):
+    types = {"str": pa.string(), "int": pa.int64(), "float": pa.float64()}
+    return pa.schema([pa.field(header, types[kind]) for header, kind in zip(sheet.headers, sheet.types)])
+
+
+def _arrow_batches(pa, schema, rows):
+    """ Собирает строки в пакеты (RecordBatch) по ARROW_BATCH_ROWS строк. """
+    while True:
+        batch = list(islice(rows, ARROW_BATCH_ROWS))
+        if not batch:
+            return
+        columns = list(zip(*batch))
+        yield pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                              schema=schema)
@@ -1,28 +1,67 @@
+from startup_trace import trace  # Первым импортом: с него начинается отсчёт времени запуска
+import argparse
+import os
+import shutil
 import sys
+import tempfile
 import traceback
-from PyQt6.QtWidgets import QApplication, QDialog
-from ui_main import MainApp
-from database import Database
-from registration_ui import RegistrationDialog, LoginDialog
+
+with trace.phase("импорт PyQt6"):
+    from PyQt6.QtCore import QTimer
+    from PyQt6.QtWidgets import QApplication, QDialog
+with trace.phase("импорт модулей приложения"):
+    from database import Database, PERFORMANCE_PROFILES
+    from registration_ui import RegistrationDialog, LoginDialog
 
 def exception_hook(exc_type, exc_value, exc_traceback):
     traceback.print_exception(exc_type, exc_value, exc_traceback)
     sys.exit(1)
 
 sys.excepthook = exception_hook
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Система управления заказами")
+    parser.add_argument("--trace", action="store_true", help="напечатать трассировку запуска")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="запуск без экрана и без ввода: открыть все окна, напечатать трассировку и выйти")
+    parser.add_argument("--db", default="store.db", help="файл базы данных")
+    parser.add_argument("--profile", choices=sorted(PERFORMANCE_PROFILES),
+                        default=os.environ.get("STORE_DB_PROFILE", "default"),
+                        help="профиль SQLite (database.PERFORMANCE_PROFILES): default - WAL, "
+                             "safe - журнал отката для сетевых дисков; по умолчанию STORE_DB_PROFILE или default")
+    parser.add_argument("--json", action="store_true", help="в режиме --benchmark напечатать трассировку в JSON")
+    # Остальные аргументы (например, -platform) передаются Qt
+    args, qt_args = parser.parse_known_args()
+    if args.profile not in PERFORMANCE_PROFILES:  # Значение по умолчанию из окружения argparse не проверяет
+        parser.error(f"неизвестный профиль STORE_DB_PROFILE: {args.profile}")
+    return args, sys.argv[:1] + qt_args
+
+
 def main():
-    app = QApplication(sys.argv)
-    db = Database()
+    args, qt_args = parse_args()
+    if args.benchmark:
+        return run_benchmark(args.db, qt_args, args.json, args.profile)
+    if args.trace:
+        trace.enabled = True
+
+    with trace.phase("QApplication"):
+        app = QApplication(qt_args)
+    with trace.phase("открытие базы данных"):
+        db = Database(args.db, args.profile)
 
     while True:
         # Всегда показываем окно регистрации первым
-        registration_dialog = RegistrationDialog(db)
+        with trace.phase("окно регистрации"):
+            registration_dialog = RegistrationDialog(db)
+        trace.mark("окно регистрации показано")
         if registration_dialog.exec() == QDialog.DialogCode.Accepted:
             # Успешная регистрация
             continue  # Вернуться в цикл для входа
 
         # Если пользователь выбрал "Уже есть аккаунт", переключаемся на окно входа
-        login_dialog = LoginDialog(db)
+        with trace.phase("окно входа"):
+            login_dialog = LoginDialog(db)
         if login_dialog.exec() != QDialog.DialogCode.Accepted:
             return  # Закрыть приложение, если вход не выполнен
 
@@ -30,13 +69,69 @@ def main():
         user_id, role = login_dialog.user_id, login_dialog.role
         break
 
-    # Открыть основное приложение после успешного входа
-    main_window = MainApp(db, user_id, role)
-    main_window.show()
+    # Открыть основное приложение после успешного входа.
+    # Главное окно импортируется только здесь, чтобы окно регистрации появлялось быстрее
+    with trace.phase("импорт главного окна"):
+        from ui_main import MainApp
+
+    with trace.phase("главное окно"):
+        main_window = MainApp(db, user_id, role)
+        main_window.show()
+    if trace.enabled:
+        # Отчёт печатается, когда главное окно отрисовано и приложение ждёт ввода
+        QTimer.singleShot(0, lambda: (trace.mark("главное окно показано"), trace.print_report()))
     sys.exit(app.exec())
 
 
+def run_benchmark(db_path, qt_args, as_json=False, profile="default"):
+    """
+    Запуск без экрана (QT_QPA_PLATFORM=offscreen) и без ввода: окна регистрации и входа создаются
+    и показываются, затем открывается главное окно администратора (он видит все заказы).
+    Работает с копией базы, чтобы миграции и очистка журнала не меняли исходный файл.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    trace.enabled = True
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy_path = os.path.join(directory, os.path.basename(db_path))
+        if os.path.exists(db_path):
+            shutil.copyfile(db_path, copy_path)
+
+        with trace.phase("QApplication"):
+            app = QApplication(qt_args)
+        with trace.phase("открытие базы данных"):
+            db = Database(copy_path, profile)
+
+        with trace.phase("окно регистрации"):
+            registration_dialog = RegistrationDialog(db)
+            registration_dialog.show()
+            app.processEvents()
+        trace.mark("окно регистрации показано")
+        registration_dialog.close()
+
+        with trace.phase("окно входа"):
+            login_dialog = LoginDialog(db)
+            login_dialog.show()
+            app.processEvents()
+        login_dialog.close()
+
+        user = db.fetch_one("SELECT id, role FROM users ORDER BY role = 'admin' DESC, id LIMIT 1")
+        user_id, role = user if user else (None, "admin")
+
+        with trace.phase("импорт главного окна"):
+            from ui_main import MainApp
+        with trace.phase("главное окно"):
+            main_window = MainApp(db, user_id, role)
+            main_window.show()
+            app.processEvents()
+        trace.mark("главное окно показано")
+
+        main_window.close()
+        db.close()
+
+    print(trace.as_json() if as_json else trace.report())
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,181 @@
+from database import chunked, placeholders, STOCK_RESERVED, STOCK_RELEASED
+from stock import (InsufficientStockError, add_holding, apply_stock_deltas, change_holding, held_quantities,
+                   move_stock, state_for_status)
+
+
+def fetch_prices(tx, product_ids):
+    """
+    Возвращает {id: цена} для указанных товаров одним запросом IN (...) на каждые ID_CHUNK_SIZE товаров.
+    """
+    prices = {}
+    for chunk in chunked(product_ids):
+        prices.update(tx.fetch_all(f"SELECT id, price FROM products WHERE id IN ({placeholders(chunk)})", chunk))
+    return prices
+
+
+def total_quantities(order_items):
+    """ Суммарное количество по каждому товару (один товар может встретиться в нескольких позициях). """
+    quantities = {}
+    for product_id, quantity in order_items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def create_order(db, user_id, order_items, status="Ожидание"):
+    """
+    Создаёт заказ одной транзакцией.
+    Цены читаются одним запросом, позиции пишутся через executemany, товар резервируется
+    условными UPDATE (см. stock.move_stock), поэтому два одновременных заказа не могут
+    получить один и тот же остаток.
+    :param order_items: список кортежей (id_товара, количество)
+    :return: (id заказа, номер заказа)
+    :raises InsufficientStockError: если какого-либо товара нет или его недостаточно на складе
+    """
+    quantities = total_quantities(order_items)
+    stock_state = state_for_status(status)
+
+    with db.transaction() as tx:
+        prices = fetch_prices(tx, quantities)
+        for product_id in quantities:
+            if product_id not in prices:
+                raise InsufficientStockError(product_id)
+        move_stock(tx, quantities, STOCK_RELEASED, stock_state)
+
+        # Номер заказа выделяется счётчиком в этой же транзакции
+        order_number = f"ORD-{db.next_sequence_value('order_number')}"
+
+        order_id = tx.execute("INSERT INTO orders (user_id, order_number, status, stock_state) VALUES (?, ?, ?, ?)",
+                              (user_id, order_number, status, stock_state)).lastrowid
+
+        tx.executemany("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                       [(order_id, product_id, quantity, prices[product_id] * quantity)
+                        for product_id, quantity in order_items])
+
+    return order_id, order_number
+
+
+def set_order_status(db, order_id, status):
+    """
+    Меняет статус заказа и переводит его товар в соответствующее состояние:
+    "завершено" списывает зарезервированный товар со склада, "отменено" снимает резерв
+    (или возвращает на склад списанный товар), остальные статусы резервируют товар.
+    :raises InsufficientStockError: если заказ снова занимает товар, а свободного остатка не хватает
+    """
+    set_orders_status(db, [order_id], status)
+
+
+def set_orders_status(db, order_ids, status):
+    """
+    Меняет статус нескольких заказов одной транзакцией (складской учёт - как в set_order_status).
+    Товар всех заказов переводится одним набором итоговых изменений по товарам (stock.apply_stock_deltas),
+    статусы меняются запросами UPDATE ... WHERE id IN (...) по ID_CHUNK_SIZE заказов.
+    Заказы, у которых статус уже такой, не изменяются.
+    :return: число изменённых заказов
+    :raises InsufficientStockError: если свободного остатка не хватает; ни один заказ не изменяется
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    stock_state = state_for_status(status)
+
+    with db.transaction() as tx:
+        deltas = {}
+        for state, quantities in held_quantities(tx, order_ids).items():
+            if state != stock_state:
+                add_holding(deltas, quantities, state, -1)
+                add_holding(deltas, quantities, stock_state, 1)
+        apply_stock_deltas(tx, deltas)
+
+        changed = 0
+        for chunk in chunked(order_ids):
+            changed += tx.execute(f"""
+                UPDATE orders SET status = ?, stock_state = ?
+                WHERE id IN ({placeholders(chunk)}) AND (status IS NOT ? OR stock_state IS NOT ?)
+            """, (status, stock_state, *chunk, status, stock_state)).rowcount
+    return changed
+
+
+def update_order(db, order_id, user_id, status, order_items):
+    """
+    Сохраняет изменения заказа одной транзакцией, затрагивая только то, что изменилось:
+    - склад: для каждого товара применяется итоговое изменение (новое количество и состояние
+      минус прежние), см. stock.change_holding;
+    - позиции: удаляются позиции исчезнувших товаров, обновляются позиции с новым количеством
+      (цена пересчитывается по текущей цене товара), добавляются новые товары; неизменённые
+      позиции не трогаются и сохраняют цену на момент заказа. Все изменения - через executemany.
+    Повторяющиеся позиции одного товара объединяются в одну.
+    :param order_items: список кортежей (id_товара, количество)
+    :raises InsufficientStockError: если товара недостаточно; заказ остаётся прежним
+    """
+    quantities = total_quantities(order_items)
+    stock_state = state_for_status(status)
+
+    with db.transaction() as tx:
+        order = tx.fetch_one("SELECT user_id, status, stock_state FROM orders WHERE id = ?", (order_id,))
+        if order is None:
+            return
+
+        # Текущие позиции по товарам: [id позиций], общее количество
+        lines = {}
+        for line_id, product_id, quantity in tx.fetch_all(
+                "SELECT id, product_id, quantity FROM order_items WHERE order_id = ? ORDER BY id", (order_id,)):
+            line_ids, total = lines.get(product_id, ([], 0))
+            lines[product_id] = (line_ids + [line_id], total + quantity)
+
+        deleted, changed = [], []
+        for product_id, (line_ids, total) in lines.items():
+            if product_id not in quantities:
+                deleted.extend(line_ids)
+                continue
+            deleted.extend(line_ids[1:])
+            if total != quantities[product_id] or len(line_ids) > 1:
+                changed.append((product_id, line_ids[0]))
+        added = [product_id for product_id in quantities if product_id not in lines]
+
+        repriced = [product_id for product_id, _ in changed] + added
+        prices = fetch_prices(tx, repriced)
+        for product_id in repriced:
+            if product_id not in prices:
+                raise InsufficientStockError(product_id)
+
+        change_holding(tx, {product_id: total for product_id, (_, total) in lines.items()}, order[2],
+                       quantities, stock_state)
+
+        for chunk in chunked(deleted):
+            tx.execute(f"DELETE FROM order_items WHERE id IN ({placeholders(chunk)})", chunk)
+        tx.executemany("UPDATE order_items SET quantity = ?, price = ? WHERE id = ?",
+                       [(quantities[product_id], prices[product_id] * quantities[product_id], line_id)
+                        for product_id, line_id in changed])
+        tx.executemany("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                       [(order_id, product_id, quantities[product_id], prices[product_id] * quantities[product_id])
+                        for product_id in added])
+
+        if (user_id, status, stock_state) != tuple(order):
+            tx.execute("UPDATE orders SET user_id = ?, status = ?, stock_state = ? WHERE id = ?",
+                       (user_id, status, stock_state, order_id))
+
+
+def delete_order(db, order_id):
+    """
+    Удаляет заказ с позициями. Резерв снимается; товар завершённого заказа остаётся списанным.
+    """
+    delete_orders(db, [order_id])
+
+
+def delete_orders(db, order_ids):
+    """
+    Удаляет несколько заказов с позициями одной транзакцией (см. delete_order): резерв всех
+    заказов снимается одним набором изменений по товарам, строки удаляются запросами
+    DELETE ... WHERE ... IN (...) по ID_CHUNK_SIZE заказов.
+    :return: число удалённых заказов
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+
+    with db.transaction() as tx:
+        deltas = {}
+        add_holding(deltas, held_quantities(tx, order_ids).get(STOCK_RESERVED, {}), STOCK_RESERVED, -1)
+        apply_stock_deltas(tx, deltas)
+
+        deleted = 0
+        for chunk in chunked(order_ids):
+            tx.execute(f"DELETE FROM order_items WHERE order_id IN ({placeholders(chunk)})", chunk)
+            deleted += tx.execute(f"DELETE FROM orders WHERE id IN ({placeholders(chunk)})", chunk).rowcount
+    return deleted
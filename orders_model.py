@@ -0,0 +1,306 @@
+from bisect import bisect_right
+
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from database import chunked, placeholders
+
+# Сколько заказов загружать за одну порцию при прокрутке таблицы
+PAGE_SIZE = 200
+
+
+def order_sort_key(order):
+    """
+    Ключ порядка отображения строки заказа: таблица отсортирована по убыванию ключа,
+    новые заказы сверху, заказы без времени создания (NULL) - в самом конце.
+    """
+    return order_key(order[8], order[0])
+
+
+def order_key(created_at, order_id):
+    return created_at is not None, created_at or "", order_id
+
+
+class OrdersLoader:
+    """
+    Запросы строк для таблицы заказов.
+    Администратор видит все заказы, пользователь - только свои (user_id).
+    """
+
+    QUERY = """
+        SELECT
+            orders.id,
+            orders.order_number,
+            users.username,
+            GROUP_CONCAT(products.name || '|' || order_items.quantity || '|' || order_items.price, '\n') AS product_list,
+            COUNT(order_items.id) AS line_count,
+            SUM(order_items.quantity) AS total_quantity,
+            SUM(order_items.price) AS total_price,
+            orders.status,
+            orders.created_at
+        FROM orders
+        JOIN users ON orders.user_id = users.id
+        JOIN order_items ON order_items.order_id = orders.id
+        JOIN products ON order_items.product_id = products.id
+        {where}
+        GROUP BY orders.id
+    """
+
+    def __init__(self, db, user_id=None):
+        self.db = db
+        self.user_id = user_id
+
+    def _fetch(self, conditions, params):
+        if self.user_id is not None:
+            conditions = conditions + ["users.id = ?"]
+            params = tuple(params) + (self.user_id,)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.db.fetch_all(self.QUERY.format(where=where), params)
+
+    def fetch_by_ids(self, order_ids):
+        """Возвращает строки только для указанных заказов (удалённые заказы в результат не попадают)."""
+        rows = []
+        for chunk in chunked(order_ids):
+            rows.extend(self._fetch([f"orders.id IN ({placeholders(chunk)})"], chunk))
+        return rows
+
+    def fetch_page(self, after=None, limit=PAGE_SIZE):
+        """
+        Загружает следующую порцию заказов по ключу (created_at, id), новые заказы первыми.
+        Вместо OFFSET используется условие "ключ меньше последнего загруженного",
+        поэтому стоимость порции не зависит от того, сколько заказов уже загружено.
+        :param after: ключ (created_at, id) последнего заказа предыдущей порции или None для первой порции.
+        :return: (строки заказов, ключ последнего заказа порции, есть ли ещё заказы)
+        """
+        keys = []
+        # Сначала заказы со временем создания, затем старые заказы без него (NULL нельзя сравнивать по ключу)
+        if after is None or after[0] is not None:
+            condition, params = "created_at IS NOT NULL", ()
+            if after is not None:
+                condition, params = "created_at IS NOT NULL AND (created_at, id) < (?, ?)", after
+            keys.extend(self._page_keys(condition, params, "created_at DESC, id DESC", limit))
+        if len(keys) < limit:
+            condition, params = "created_at IS NULL", ()
+            if after is not None and after[0] is None:
+                condition, params = "created_at IS NULL AND id < ?", (after[1],)
+            keys.extend(self._page_keys(condition, params, "id DESC", limit - len(keys)))
+
+        if not keys:
+            return [], after, False
+        orders = self.fetch_by_ids(order_id for _, order_id in keys)
+        return orders, keys[-1], len(keys) == limit
+
+    def _page_keys(self, condition, params, order_by, limit):
+        if self.user_id is not None:
+            condition += " AND user_id = ?"
+            params = tuple(params) + (self.user_id,)
+        rows = self.db.fetch_all(
+            f"SELECT created_at, id FROM orders WHERE {condition} ORDER BY {order_by} LIMIT ?",
+            tuple(params) + (limit,))
+        return [tuple(row) for row in rows]
+
+
+class OrdersTableModel(QAbstractTableModel):
+    """
+    Модель таблицы заказов для QTableView.
+    Каждый заказ занимает строку с итогами и по строке на каждый товар.
+    Ячейки не создаются заранее: data() вычисляет значение по запросу,
+    поэтому затраты зависят от видимой части таблицы, а не от числа заказов.
+    Заказы подгружаются порциями (canFetchMore/fetchMore) по мере прокрутки.
+    """
+
+    HEADERS = ["Имя заказчика", "Номер заказа", "Товар", "Количество", "Цена", "Статус", "Время создания"]
+
+    def __init__(self, loader, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        # Строки запроса: (id, номер, заказчик, список товаров, число позиций, количество, сумма, статус, время)
+        self._orders = []
+        # Ключи порядка отображения (по убыванию) для двоичного поиска и ключ каждого загруженного заказа
+        self._sort_keys = []
+        self._keys = {}
+        # Номер первой строки таблицы для каждого заказа (последний элемент - общее число строк)
+        self._offsets = [0]
+        # Разобранные списки товаров, заполняются при первом обращении
+        self._lines = {}
+        # Ключ (created_at, id) последнего загруженного заказа и признак, что в базе есть ещё заказы
+        self._cursor = None
+        self._has_more = False
+
+    def reload(self):
+        """Сбрасывает модель и загружает первую порцию заказов."""
+        self.beginResetModel()
+        self._orders = []
+        self._sort_keys = []
+        self._keys = {}
+        self._lines = {}
+        self._offsets = [0]
+        self._cursor = None
+        self._has_more = True
+        self._append(self._next_page())
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        orders = self._next_page()
+        if not orders:
+            return
+        first = self._offsets[-1]
+        self.beginInsertRows(QModelIndex(), first, first + sum(1 + order[4] for order in orders) - 1)
+        self._append(orders)
+        self.endInsertRows()
+
+    def refresh_orders(self, order_ids):
+        """
+        Обновляет только изменённые заказы.
+        :param order_ids: id заказов, отмеченных в журнале изменений; заказы, которых больше нет
+                          в выборке, удаляются из таблицы.
+        """
+        fresh = {order[0]: order for order in self.loader.fetch_by_ids(order_ids)}
+        changes = []  # (ключ, новая строка заказа или None для удаления)
+        for order_id in dict.fromkeys(order_ids):
+            self._lines.pop(order_id, None)
+            old_key = self._keys.get(order_id)
+            order = fresh.get(order_id)
+            position = self._position(old_key) if old_key is not None else None
+
+            if position is not None and order is not None and order_sort_key(order) == old_key \
+                    and order[4] == self._orders[position][4]:
+                # Число строк и место заказа не изменились - достаточно перерисовать его строки
+                self._orders[position] = order
+                first, last = self._offsets[position], self._offsets[position + 1] - 1
+                self.dataChanged.emit(self.index(first, 0), self.index(last, len(self.HEADERS) - 1))
+                continue
+
+            if position is not None:
+                changes.append((old_key, None))
+            if order is not None and self._is_loaded_range(order_sort_key(order)):
+                changes.append((order_sort_key(order), order))
+
+        # Изменения применяются снизу вверх (по возрастанию ключа, удаление раньше вставки с тем же ключом):
+        # номера строк выше изменяемого места остаются верными, а ниже пересчитываются один раз в конце
+        changed_from = len(self._orders)
+        for key, order in sorted(changes, key=lambda change: (change[0], change[1] is not None)):
+            if order is None:
+                changed_from = self._position(key)
+                self._remove_order(changed_from)
+            else:
+                changed_from = self._insert_order(order)
+        if changed_from < len(self._orders):
+            self._rebuild_offsets(changed_from)
+
+    def order_id_at(self, row):
+        """id заказа, к которому относится строка таблицы (строка итогов или строка товара)."""
+        return self._orders[bisect_right(self._offsets, row) - 1][0]
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._offsets[-1]
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+
+        order_index = bisect_right(self._offsets, index.row()) - 1
+        line = index.row() - self._offsets[order_index]
+        order = self._orders[order_index]
+        column = index.column()
+
+        if line == 0:
+            # Строка с итогами заказа
+            _, order_number, username, _, _, total_quantity, total_price, status, created_at = order
+            return (username, order_number, "", str(total_quantity), f"{total_price:.2f}₽", status, created_at)[column]
+
+        # Строка с товаром заказа
+        product_name, quantity, price = self._product_lines(order)[line - 1]
+        return ("", "", product_name, quantity, f"{price:.2f}₽", "", "")[column]
+
+    def _next_page(self):
+        """Загружает порции, пока не найдётся хотя бы один заказ с товарами или заказы не закончатся."""
+        orders = []
+        while self._has_more and not orders:
+            page, self._cursor, self._has_more = self.loader.fetch_page(self._cursor)
+            orders = [order for order in page if order[0] not in self._keys]
+        return sorted(orders, key=order_sort_key, reverse=True)
+
+    def _append(self, orders):
+        for order in orders:
+            key = order_sort_key(order)
+            self._orders.append(order)
+            self._sort_keys.append(key)
+            self._keys[order[0]] = key
+            self._offsets.append(self._offsets[-1] + 1 + order[4])
+
+    def _is_loaded_range(self, key):
+        """Попадает ли заказ в уже загруженную часть таблицы (более старые заказы придут с fetchMore)."""
+        return not self._has_more or self._cursor is None or key > order_key(*self._cursor)
+
+    def _position(self, key):
+        """Позиция заказа с ключом key в списке (или место, куда его нужно вставить)."""
+        low, high = 0, len(self._sort_keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self._sort_keys[middle] > key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _remove_order(self, position):
+        """Удаляет заказ position; номера строк следующих заказов пересчитывает _rebuild_offsets."""
+        first, last = self._offsets[position], self._offsets[position + 1] - 1
+        self.beginRemoveRows(QModelIndex(), first, last)
+        del self._keys[self._orders[position][0]]
+        del self._orders[position]
+        del self._sort_keys[position]
+        total = self._offsets[-1]
+        del self._offsets[position + 1]
+        self._offsets[-1] = total - (last - first + 1)
+        self.endRemoveRows()
+
+    def _insert_order(self, order):
+        """Вставляет заказ по ключу сортировки и возвращает его позицию (см. _remove_order)."""
+        key = order_sort_key(order)
+        position = self._position(key)
+        first = self._offsets[position]
+        self.beginInsertRows(QModelIndex(), first, first + order[4])
+        self._orders.insert(position, order)
+        self._sort_keys.insert(position, key)
+        self._keys[order[0]] = key
+        total = self._offsets[-1]
+        self._offsets.insert(position + 1, first + 1 + order[4])
+        self._offsets[-1] = total + 1 + order[4]
+        self.endInsertRows()
+        return position
+
+    def _rebuild_offsets(self, position):
+        """Пересчитывает номера строк начиная с заказа position."""
+        del self._offsets[position + 1:]
+        for order in self._orders[position:]:
+            self._offsets.append(self._offsets[-1] + 1 + order[4])
+
+    def _product_lines(self, order):
+        """Разбирает GROUP_CONCAT со списком товаров заказа (однократно для каждого заказа)."""
+        order_id, product_list = order[0], order[3]
+        lines = self._lines.get(order_id)
+        if lines is None:
+            lines = []
+            for product_details in (product_list or "").split('\n'):
+                product_name, quantity, price = product_details.rsplit('|', 2)
+                lines.append((product_name, quantity, float(price)))
+            self._lines[order_id] = lines
+        return lines
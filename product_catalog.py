@@ -0,0 +1,76 @@
+import threading
+from collections import namedtuple
+
+# Товар в каталоге. Остатки (quantity, reserved) меняются с каждым заказом и в каталог не входят.
+Product = namedtuple("Product", ["id", "name", "price"])
+
+# Ключ версии каталога в schema_meta; триггеры увеличивают её при добавлении и удалении товара
+# и при изменении его названия или цены (см. Database.migrate_product_catalog_version)
+CATALOG_VERSION_KEY = "products_version"
+
+# Сколько товаров возвращает поиск (список выбора показывает только первые совпадения)
+SEARCH_LIMIT = 50
+
+
+class ProductCatalog:
+    """
+    Список товаров, общий для всех окон процесса. Товары читаются из базы один раз и
+    перечитываются, только когда версия каталога в базе изменилась (в том числе другим клиентом).
+    Проверка версии - один запрос по первичному ключу schema_meta.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._version = None
+        self._products = []
+
+    def version(self):
+        return self.db.get_meta(CATALOG_VERSION_KEY, "0")
+
+    def products(self):
+        """ Все товары в порядке id. """
+        # Внутри своей транзакции могут быть незафиксированные изменения товаров:
+        # читаем их напрямую и не сохраняем в кэш (транзакция ещё может быть отменена)
+        if self.db.owns_transaction():
+            return self._fetch()
+
+        with self._lock:
+            # Версия читается до товаров: если товары изменятся между запросами,
+            # сохранённая версия окажется старой и каталог просто перечитается ещё раз
+            version = self.version()
+            if version != self._version:
+                self._products = self._fetch()
+                self._version = version
+            return self._products
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        """
+        Поиск товаров по началу слов названия: "мол пас" найдёт "Молоко пастеризованное".
+        Использует индекс products_fts, без него - LIKE по подстроке. Каталог целиком не загружается.
+        :return: не более limit товаров; при пустом запросе - первые товары по id
+        """
+        words = text.split()
+        if not words:
+            rows = self.db.fetch_all("SELECT id, name, price FROM products ORDER BY id LIMIT ?", (limit,))
+        elif self.db.product_search:
+            # Каждое слово - префиксный запрос в кавычках, чтобы символы запроса не разбирались как синтаксис FTS5
+            match = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+            rows = self.db.fetch_all("""
+                SELECT products.id, products.name, products.price
+                FROM products_fts
+                JOIN products ON products.id = products_fts.rowid
+                WHERE products_fts MATCH ?
+                ORDER BY products_fts.rank
+                LIMIT ?
+            """, (match, limit))
+        else:
+            patterns = ["%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                        for word in words]
+            conditions = " AND ".join("name LIKE ? ESCAPE '\\'" for _ in patterns)
+            rows = self.db.fetch_all(f"SELECT id, name, price FROM products WHERE {conditions} ORDER BY name LIMIT ?",
+                                     tuple(patterns) + (limit,))
+        return [Product(*row) for row in rows]
+
+    def _fetch(self):
+        return [Product(*row) for row in self.db.fetch_all("SELECT id, name, price FROM products ORDER BY id")]
@@ -0,0 +1,256 @@
+"""
+Импорт прайс-листов поставщиков (CSV или XLSX) в таблицу products.
+
+Файл читается потоково, строки проверяются и записываются порциями по IMPORT_CHUNK_ROWS:
+каждая порция - одна транзакция с INSERT ... ON CONFLICT (sku) DO UPDATE через executemany.
+Товар определяется по артикулу (products.sku): новый артикул добавляет товар, известный -
+обновляет название, цену и (если в файле есть столбец количества) остаток на складе.
+Строки с ошибками пропускаются и перечисляются в результате. При отмене уже записанные
+порции остаются в базе, поэтому повторный импорт того же файла просто продолжит обновление.
+"""
+import codecs
+import csv
+import os
+from collections import namedtuple
+
+from database import chunked, placeholders
+
+# Сколько строк файла записывается одной транзакцией
+IMPORT_CHUNK_ROWS = 5000
+
+# Сколько байт начала CSV-файла используется для определения кодировки и разделителя
+CSV_SAMPLE_BYTES = 64 * 1024
+
+# Сколько ошибок хранить для показа пользователю (считаются все)
+MAX_REPORTED_ERRORS = 100
+
+# Допустимые заголовки столбцов (без учёта регистра); количество - необязательный столбец
+COLUMN_ALIASES = {
+    "sku": ("sku", "артикул", "код"),
+    "name": ("name", "название", "наименование", "товар"),
+    "price": ("price", "цена"),
+    "quantity": ("quantity", "количество", "остаток"),
+}
+REQUIRED_COLUMNS = ("sku", "name", "price")
+
+ImportRow = namedtuple("ImportRow", ["sku", "name", "price", "quantity"])
+ImportProgress = namedtuple("ImportProgress", ["rows", "inserted", "updated", "errors"])
+ImportResult = namedtuple("ImportResult", ["inserted", "updated", "unchanged", "error_count", "errors"])
+
+UPSERT_PRODUCT = """
+    INSERT INTO products (sku, name, price, quantity) VALUES (?1, ?2, ?3, COALESCE(?4, 0))
+    ON CONFLICT (sku) WHERE sku IS NOT NULL DO UPDATE SET
+        name = excluded.name,
+        price = excluded.price,
+        quantity = COALESCE(?4, products.quantity)
+"""
+
+
+class ImportFileError(ValueError):
+    """ Файл нельзя импортировать целиком (неизвестный формат, нет нужных столбцов). """
+
+
+def read_rows(filepath):
+    """
+    Построчно читает таблицу из CSV или XLSX (первый лист).
+    :return: генератор списков значений; первая строка - заголовки
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == ".csv":
+        return _read_csv(filepath)
+    if extension == ".xlsx":
+        return _read_xlsx(filepath)
+    raise ImportFileError(f"Неподдерживаемый формат файла: {extension or 'без расширения'}")
+
+
+def _csv_encoding(filepath):
+    """
+    Кодировка CSV-файла: UTF-8 (с BOM или без) или cp1251, в которой сохраняет CSV Excel с русской локалью.
+    """
+    with open(filepath, "rb") as file:
+        sample = file.read(CSV_SAMPLE_BYTES)
+    try:
+        # final=False: образец может оборваться посреди многобайтового символа
+        codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return "cp1251"
+    return "utf-8-sig"
+
+
+def _read_csv(filepath):
+    with open(filepath, newline="", encoding=_csv_encoding(filepath)) as file:
+        # Excel с русской локалью сохраняет CSV через ';', остальные программы - через ','
+        sample = file.read(CSV_SAMPLE_BYTES)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(file, dialect)
+
+
+def _read_xlsx(filepath):
+    # openpyxl загружается только при импорте из .xlsx, а не при запуске приложения
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def column_positions(headers):
+    """
+    Сопоставляет заголовки файла столбцам импорта.
+    :return: словарь столбец -> номер столбца в файле
+    :raises ImportFileError: если нет обязательного столбца
+    """
+    names = [str(header).strip().lower() if header is not None else "" for header in headers]
+    positions = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                positions[column] = names.index(alias)
+                break
+    missing = [COLUMN_ALIASES[column][1] for column in REQUIRED_COLUMNS if column not in positions]
+    if missing:
+        raise ImportFileError(f"В файле нет столбцов: {', '.join(missing)}")
+    return positions
+
+
+def _number_text(text):
+    """ Число из ячейки без разделителей разрядов (пробел, неразрывный пробел Excel) и с точкой. """
+    for separator in (" ", "\xa0", "\u202f"):
+        text = text.replace(separator, "")
+    return text.replace(",", ".")
+
+
+def parse_row(values, positions):
+    """
+    Проверяет строку файла.
+    :return: ImportRow
+    :raises ValueError: с описанием ошибки
+    """
+    def value(column):
+        position = positions.get(column)
+        if position is None or position >= len(values) or values[position] is None:
+            return ""
+        cell = values[position]
+        # Числовой артикул из Excel приходит как 123.0
+        if isinstance(cell, float) and cell.is_integer():
+            cell = int(cell)
+        return str(cell).strip()
+
+    sku, name = value("sku"), value("name")
+    if not sku:
+        raise ValueError("не указан артикул")
+    if not name:
+        raise ValueError("не указано название")
+
+    try:
+        price = float(_number_text(value("price")))
+    except ValueError:
+        raise ValueError(f"неверная цена: {value('price')!r}")
+    if price < 0:
+        raise ValueError("цена меньше нуля")
+
+    quantity = None
+    if value("quantity"):
+        try:
+            quantity = int(float(_number_text(value("quantity"))))
+        except ValueError:
+            raise ValueError(f"неверное количество: {value('quantity')!r}")
+        if quantity < 0:
+            raise ValueError("количество меньше нуля")
+
+    return ImportRow(sku, name, price, quantity)
+
+
+def import_products(job, db, filepath):
+    """
+    Фоновая задача импорта прайс-листа (см. workers.start_job).
+    :return: ImportResult
+    """
+    rows = read_rows(filepath)
+    try:
+        headers = next(rows, None)
+        if headers is None:
+            raise ImportFileError("Файл пуст")
+        positions = column_positions(headers)
+
+        inserted = updated = unchanged = error_count = 0
+        errors = []
+        chunk = {}  # Артикул -> строка; повтор артикула в файле заменяет предыдущую строку
+        line_numbers = {}
+        read = 0
+
+        def add_error(line, message):
+            nonlocal error_count
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"Строка {line}: {message}")
+
+        def flush():
+            nonlocal inserted, updated, unchanged
+            counts = _write_chunk(db, chunk, line_numbers, add_error)
+            inserted, updated, unchanged = inserted + counts[0], updated + counts[1], unchanged + counts[2]
+            chunk.clear()
+            line_numbers.clear()
+            job.report(ImportProgress(read, inserted, updated, error_count))
+
+        for line, values in enumerate(rows, start=2):
+            read += 1
+            if not any(value not in (None, "") for value in values):
+                continue  # Пустые строки в конце листа
+            try:
+                row = parse_row(values, positions)
+            except ValueError as e:
+                add_error(line, str(e))
+                continue
+            chunk[row.sku] = row
+            line_numbers[row.sku] = line
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        rows.close()
+
+    return ImportResult(inserted, updated, unchanged, error_count, errors)
+
+
+def _write_chunk(db, chunk, line_numbers, add_error):
+    """
+    Записывает порцию строк одной транзакцией.
+    Строки, не меняющие товар, не записываются (и не запускают триггеры каталога и поиска);
+    остаток нельзя сделать меньше зарезервированного заказами количества.
+    :return: (добавлено, обновлено, без изменений)
+    """
+    inserted = updated = unchanged = 0
+    with db.transaction() as tx:
+        existing = {}
+        for skus in chunked(list(chunk)):
+            for sku, name, price, quantity, reserved in tx.fetch_all(
+                    f"SELECT sku, name, price, quantity, reserved FROM products WHERE sku IN ({placeholders(skus)})",
+                    skus):
+                existing[sku] = (name, price, quantity, reserved)
+
+        changes = []
+        for sku, row in chunk.items():
+            current = existing.get(sku)
+            if current is None:
+                inserted += 1
+            else:
+                name, price, quantity, reserved = current
+                if row.quantity is not None and row.quantity < reserved:
+                    add_error(line_numbers[sku],
+                              f"остаток {row.quantity} меньше зарезервированного заказами ({reserved})")
+                    continue
+                if (row.name, row.price) == (name, price) and row.quantity in (None, quantity):
+                    unchanged += 1
+                    continue
+                updated += 1
+            changes.append(row)
+        tx.executemany(UPSERT_PRODUCT, changes)
+    return inserted, updated, unchanged
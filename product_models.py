@@ -0,0 +1,70 @@
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex
+
+from product_catalog import SEARCH_LIMIT
+
+
+class ProductSearchModel(QAbstractListModel):
+    """
+    Результаты поиска товаров для списка выбора (QListView).
+    Хранит только найденные товары (не больше SEARCH_LIMIT), поэтому окно открывается
+    одинаково быстро при любом размере каталога. id товара доступен через Qt.ItemDataRole.UserRole.
+    """
+
+    def __init__(self, catalog, parent=None, limit=SEARCH_LIMIT):
+        super().__init__(parent)
+        self.catalog = catalog
+        self.limit = limit
+        self._products = []
+
+    def search(self, text):
+        """ Заменяет результаты найденными по тексту запроса товарами. """
+        self.beginResetModel()
+        self._products = self.catalog.search(text, self.limit)
+        self.endResetModel()
+
+    def product(self, row):
+        """ Товар (product_catalog.Product) в строке row. """
+        return self._products[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._products)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        product = self._products[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{product.name} ({product.price:.2f})"
+        if role == Qt.ItemDataRole.UserRole:
+            return product.id
+        return None
+
+
+class ProductListModel(QAbstractListModel):
+    """
+    Список товаров каталога для выпадающих списков (QComboBox.setModel).
+    Одну модель используют все строки окна, поэтому новая строка не копирует список товаров,
+    а текущий товар выбирается по индексу id -> строка без перебора элементов.
+    """
+
+    def __init__(self, products, parent=None):
+        super().__init__(parent)
+        self._products = list(products)
+        self._rows = {product.id: row for row, product in enumerate(self._products)}
+
+    def row_of(self, product_id):
+        """ Строка товара product_id или -1, если товара нет в списке. """
+        return self._rows.get(product_id, -1)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._products)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        product = self._products[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return product.name
+        if role == Qt.ItemDataRole.UserRole:
+            return product.id
+        return None
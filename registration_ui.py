@@ -1,11 +1,15 @@
 from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QMessageBox, QComboBox
 from database import Database
-import bcrypt
+from auth_service import AuthService
 
 class RegistrationDialog(QDialog):
     def __init__(self, db):
         super().__init__()
         self.db = db
+        # Хэширование пароля выполняется в фоне, результат приходит сигналами
+        self.auth = AuthService(db, self)
+        self.auth.registration_succeeded.connect(self.on_registration_succeeded)
+        self.auth.registration_failed.connect(self.on_registration_failed)
         self.setWindowTitle("Регистрация пользователя")
         self.setGeometry(300, 300, 400, 200)
 
@@ -60,14 +64,20 @@ class RegistrationDialog(QDialog):
             QMessageBox.warning(self, "Ошибка", "Все поля должны быть заполнены.")
             return
 
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        if self.auth.is_busy():
+            return
+
+        self.register_button.setEnabled(False)
+        self.auth.register(username, password, role)
 
-        try:
-            self.db.query("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, hashed_password, role))
-            QMessageBox.information(self, "Успех", "Пользователь успешно зарегистрирован.")
-            self.accept()  # Закрыть окно регистрации
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Ошибка при регистрации: {e}")
+    def on_registration_succeeded(self, user_id):
+        self.register_button.setEnabled(True)
+        QMessageBox.information(self, "Успех", "Пользователь успешно зарегистрирован.")
+        self.accept()  # Закрыть окно регистрации
+
+    def on_registration_failed(self, message):
+        self.register_button.setEnabled(True)
+        QMessageBox.critical(self, "Ошибка", message)
 
     def switch_to_login_dialog(self):
         self.reject()  # Закрываем окно регистрации, чтобы открыть окно входа
@@ -77,6 +87,10 @@ class LoginDialog(QDialog):
     def __init__(self, db):
         super().__init__()
         self.db = db
+        # Проверка пароля выполняется в фоне, результат приходит сигналами
+        self.auth = AuthService(db, self)
+        self.auth.login_succeeded.connect(self.on_login_succeeded)
+        self.auth.login_failed.connect(self.on_login_failed)
         self.setWindowTitle("Вход в систему")
         self.setGeometry(300, 300, 400, 150)
 
@@ -118,15 +132,19 @@ class LoginDialog(QDialog):
             QMessageBox.warning(self , "Ошибка ", "Все поля должны быть заполнены.")
             return
 
-        user = self.db.fetch_one("SELECT id, password, role FROM users WHERE username = ?", (username,))
-        if user:
-            user_id, hashed_password, role = user
-            if bcrypt.checkpw(password.encode('utf-8'), hashed_password):
-                QMessageBox.information(self, "Успех", "Вход выполнен успешно.")
-                self.accept()
-                self.user_id = user_id
-                self.role = role
-            else:
-                QMessageBox.critical(self, "Ошибка", "Неверный пароль.")
-        else:
-            QMessageBox.critical(self, "Ошибка", "Пользователь не найден.")
\ No newline at end of file
+        if self.auth.is_busy():
+            return
+
+        self.login_button.setEnabled(False)
+        self.auth.login(username, password)
+
+    def on_login_succeeded(self, user_id, role):
+        self.login_button.setEnabled(True)
+        QMessageBox.information(self, "Успех", "Вход выполнен успешно.")
+        self.user_id = user_id
+        self.role = role
+        self.accept()
+
+    def on_login_failed(self, message):
+        self.login_button.setEnabled(True)
+        QMessageBox.critical(self, "Ошибка", message)
@@ -0,0 +1,195 @@
+# Отчёт о продажах для экспорта: все показатели читаются одним запросом из сводных таблиц продаж
+# (database.SALES_ROLLUPS), поэтому объём работы зависит от числа товаров и месяцев, а не позиций заказов
+from collections import namedtuple
+
+# Лист (набор данных) отчёта: короткое имя (для имён файлов), название, заголовки, типы столбцов
+# ("str", "int", "float"), итератор строк и номера столбцов с денежными суммами.
+# Строки содержат исходные значения; оформление (например, символ рубля) добавляет формат выгрузки.
+ReportSheet = namedtuple("ReportSheet", ["name", "title", "headers", "types", "rows", "money_columns"])
+
+# Имена листов отчёта о продажах и листа позиций заказов
+REPORT_SHEET_NAMES = ("summary", "stock", "monthly")
+ORDER_LINES_SHEET_NAME = "new_orders"
+
+# Разделы результата (столбец kind)
+SUMMARY, PRODUCTS, MONTHS = 0, 1, 2
+
+# Число столбцов данных в каждом разделе
+SECTION_WIDTH = {SUMMARY: 2, PRODUCTS: 3, MONTHS: 3}
+
+SALES_REPORT_QUERY = """
+    SELECT 0 AS kind, NULL AS position,
+           COALESCE(SUM(income), 0), COALESCE(SUM(quantity), 0), NULL
+    FROM sales_monthly
+    UNION ALL
+    SELECT 1, products.id, products.name, products.quantity, COALESCE(sales_by_product.quantity, 0)
+    FROM products
+    LEFT JOIN sales_by_product ON sales_by_product.product_id = products.id
+    UNION ALL
+    -- Заказы без времени создания учтены в месяце ''
+    SELECT 2, month, NULLIF(month, ''), income, quantity
+    FROM sales_monthly
+    ORDER BY kind, position
+"""
+
+# Тот же отчёт за период: итоги и месяцы - из дневной сводки, продажи по товарам - из позиций
+# заказов периода (диапазон по индексу orders.created_at). {days} и {orders} - условия периода.
+PERIOD_REPORT_QUERY = """
+    SELECT 0 AS kind, NULL AS position,
+           COALESCE(SUM(income), 0), COALESCE(SUM(quantity), 0), NULL
+    FROM sales_daily WHERE {days}
+    UNION ALL
+    SELECT 1, products.id, products.name, products.quantity, COALESCE(sold.quantity, 0)
+    FROM products
+    LEFT JOIN (
+        SELECT order_items.product_id AS product_id, SUM(order_items.quantity) AS quantity
+        FROM orders
+        JOIN order_items ON order_items.order_id = orders.id
+        WHERE orders.status = 'завершено' AND {orders}
+        GROUP BY order_items.product_id
+    ) AS sold ON sold.product_id = products.id
+    UNION ALL
+    SELECT 2, substr(day, 1, 7), substr(day, 1, 7), SUM(income), SUM(quantity)
+    FROM sales_daily WHERE {days}
+    GROUP BY substr(day, 1, 7)
+    ORDER BY kind, position
+"""
+
+# Позиции заказов с ключом (created_at, id) в заданном диапазоне - для инкрементального экспорта
+ORDER_LINES_QUERY = """
+    SELECT orders.order_number, users.username, orders.created_at, orders.status,
+           products.name, order_items.quantity, order_items.price
+    FROM orders
+    LEFT JOIN users ON users.id = orders.user_id
+    JOIN order_items ON order_items.order_id = orders.id
+    LEFT JOIN products ON products.id = order_items.product_id
+    WHERE {where}
+    ORDER BY orders.created_at, orders.id, order_items.id
+"""
+
+
+class SalesReport:
+    """
+    Потоковое чтение отчёта о продажах. Запрос выполняется один раз, а его строки
+    раздаются по разделам: section(SUMMARY), section(PRODUCTS), section(MONTHS).
+    Разделы нужно читать в этом порядке - так же, как они идут в результате запроса.
+    :param date_from, date_to: необязательные границы периода, даты 'YYYY-MM-DD' включительно;
+                               заказы без времени создания в отчёт за период не попадают.
+    """
+
+    def __init__(self, db, date_from=None, date_to=None):
+        if date_from is None and date_to is None:
+            self._rows = db.iterate(SALES_REPORT_QUERY)
+        else:
+            days, orders, params = _period_conditions(date_from, date_to)
+            query = PERIOD_REPORT_QUERY.format(days=days, orders=orders)
+            # Условие дней используется в запросе дважды, условие заказов - один раз между ними
+            self._rows = db.iterate(query, params["days"] + params["orders"] + params["days"])
+        self._head = None  # Прочитанная, но ещё не отданная строка следующего раздела
+
+    def section(self, kind):
+        """ Строки раздела kind без служебных столбцов (SectionRows: close() закрывает курсор отчёта). """
+        return SectionRows(self._section_rows(kind), self)
+
+    def _section_rows(self, kind):
+        width = SECTION_WIDTH[kind]
+        while True:
+            if self._head is None:
+                self._head = next(self._rows, None)
+                if self._head is None:
+                    return
+            if self._head[0] > kind:
+                return
+            row, self._head = self._head, None
+            if row[0] == kind:
+                yield row[2:2 + width]
+
+    def close(self):
+        self._rows.close()
+
+
+class SectionRows:
+    """
+    Строки одного раздела SalesReport. Все разделы читают один курсор, поэтому close()
+    любого из них закрывает курсор отчёта: exporters.export_files закрывает строки листов
+    после записи, и курсор освобождается сразу, даже если отчёт дочитан не до конца.
+    """
+
+    def __init__(self, rows, report):
+        self._rows = rows
+        self._report = report
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._rows)
+
+    def close(self):
+        self._rows.close()
+        self._report.close()
+
+
+def _period_conditions(date_from, date_to):
+    days, orders = ["day != ''"], ["orders.created_at IS NOT NULL"]
+    params = {"days": (), "orders": ()}
+    if date_from is not None:
+        days.append("day >= ?")
+        orders.append("orders.created_at >= ?")
+        params["days"] += (date_from,)
+        params["orders"] += (date_from,)
+    if date_to is not None:
+        days.append("day <= ?")
+        orders.append("orders.created_at < date(?, '+1 day')")
+        params["days"] += (date_to,)
+        params["orders"] += (date_to,)
+    return " AND ".join(days), " AND ".join(orders), params
+
+
+def order_lines(db, after=None, until=None):
+    """
+    Позиции заказов с ключом (created_at, id) больше after и не больше until, в порядке создания.
+    Читается только диапазон индекса orders.created_at, поэтому ночная выгрузка
+    просматривает лишь заказы за прошедшие сутки.
+    :param after: ключ последнего уже выгруженного заказа или None - тогда выгружаются и старые
+                  заказы без времени создания.
+    :param until: ключ самого нового заказа на момент начала выгрузки (заказы, созданные позже,
+                  попадут в следующую выгрузку) или None, если заказов со временем создания нет.
+    """
+    conditions, params = [], ()
+    if until is not None:
+        dated = "orders.created_at IS NOT NULL AND (orders.created_at, orders.id) <= (?, ?)"
+        params += tuple(until)
+        if after is not None:
+            dated += " AND (orders.created_at, orders.id) > (?, ?)"
+            params += tuple(after)
+        conditions.append(f"({dated})")
+    if after is None:
+        conditions.append("orders.created_at IS NULL")
+    if not conditions:
+        conditions.append("0")  # Новых заказов нет
+    return db.iterate(ORDER_LINES_QUERY.format(where=" OR ".join(conditions)), params)
+
+
+def report_sheets(db, date_from=None, date_to=None):
+    """
+    Листы отчёта по завершённым заказам (за всё время или за период date_from..date_to включительно).
+    Все листы заполняются одним запросом (SalesReport), строки читаются из курсора SQLite по мере записи.
+    """
+    report = SalesReport(db, date_from, date_to)
+    return [
+        ReportSheet(REPORT_SHEET_NAMES[0], "Общая информация", ["Общий доход", "Продано товаров"], ["float", "int"],
+                    report.section(SUMMARY), (0,)),
+        ReportSheet(REPORT_SHEET_NAMES[1], "Товары на складе", ["Товар", "Остаток товара на складе", "Продано"],
+                    ["str", "int", "int"], report.section(PRODUCTS), ()),
+        ReportSheet(REPORT_SHEET_NAMES[2], "Данные по месяцам", ["Месяц", "Общий доход", "Продано товаров"],
+                    ["str", "float", "int"], report.section(MONTHS), (1,)),
+    ]
+
+
+def order_lines_sheet(db, after=None, until=None):
+    """ Лист с позициями заказов, созданных после заказа after и не позже until (см. order_lines). """
+    return ReportSheet(ORDER_LINES_SHEET_NAME, "Новые заказы",
+                       ["Номер заказа", "Заказчик", "Время создания", "Статус", "Товар", "Количество", "Цена"],
+                       ["str", "str", "str", "str", "str", "int", "float"],
+                       order_lines(db, after, until), (6,))
@@ -0,0 +1,66 @@
+"""
+Замер холодного запуска: время до показа первого окна (окна регистрации).
+
+    python startup_benchmark.py [--runs 5] [--budget 1.5] [--db store.db]
+
+Каждый запуск - новый процесс "main.py --benchmark" (без экрана, на копии базы, см. startup_trace).
+Скрипт завершается с кодом 1, если медиана превышает бюджет или при запуске были загружены
+тяжёлые модули, нужные только для экспорта (startup_trace.HEAVY_MODULES).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Допустимая медиана времени до первого окна, секунды
+DEFAULT_BUDGET = 1.5
+
+
+def run_once(db_path):
+    """ Запускает main.py --benchmark в новом процессе и возвращает его трассировку и общее время процесса. """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.join(directory, "main.py"), "--benchmark", "--json",
+                             "--db", os.path.abspath(db_path)],
+                            env=env, capture_output=True, text=True, check=True, cwd=directory).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер времени запуска до первого окна.")
+    parser.add_argument("--runs", type=int, default=5, help="число запусков")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="допустимая медиана времени до первого окна, секунды")
+    parser.add_argument("--db", default="store.db", help="база, копия которой используется для замеров")
+    args = parser.parse_args()
+
+    results = [run_once(args.db) for _ in range(args.runs)]
+
+    first_window_time = statistics.median(result["marks"]["окно регистрации показано"] for result in results)
+    main_window_time = statistics.median(result["marks"]["главное окно показано"] for result in results)
+    process_time = statistics.median(result["process"] for result in results)
+    heavy = sorted({name for result in results for name in result["heavy_modules"]})
+
+    print(f"Запусков: {args.runs}")
+    print(f"До первого окна (медиана): {first_window_time * 1000:.0f} мс")
+    print(f"До главного окна (медиана): {main_window_time * 1000:.0f} мс")
+    print(f"Процесс целиком (медиана): {process_time * 1000:.0f} мс")
+
+    failed = False
+    if heavy:
+        print(f"Ошибка: при запуске загружены модули экспорта: {', '.join(heavy)}")
+        failed = True
+    if first_window_time > args.budget:
+        print(f"Ошибка: время до первого окна больше бюджета {args.budget * 1000:.0f} мс")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
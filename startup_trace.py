@@ -0,0 +1,75 @@
+"""
+Трассировка запуска приложения: время импортов, открытия базы, создания окон и первой загрузки данных.
+
+    from startup_trace import trace
+
+    with trace.phase("открытие базы данных"):
+        db = Database()
+
+Замеры ведутся всегда (это несколько вызовов perf_counter), а отчёт печатается в stderr,
+если задана переменная окружения STORE_STARTUP_TRACE=1 или main.py запущен с --trace/--benchmark.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Модули, которые нужны только для экспорта и не должны загружаться при запуске
+HEAVY_MODULES = ("pandas", "openpyxl", "pyarrow", "export_to_excel", "exporters")
+
+
+class StartupTrace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = os.environ.get("STORE_STARTUP_TRACE") == "1"
+        self.phases = []  # (название, глубина вложенности, длительность)
+        self.marks = []   # (название, время от начала запуска)
+        self._depth = 0
+
+    @contextmanager
+    def phase(self, name):
+        """ Замеряет длительность блока; вложенные фазы показываются в отчёте с отступом. """
+        index = len(self.phases)
+        self.phases.append((name, self._depth, None))
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.phases[index] = (name, self._depth, time.perf_counter() - started)
+
+    def mark(self, name):
+        """ Отмечает момент запуска (например, показ первого окна) относительно его начала. """
+        self.marks.append((name, time.perf_counter() - self.start))
+
+    def heavy_modules(self):
+        return [name for name in HEAVY_MODULES if name in sys.modules]
+
+    def report(self):
+        lines = ["Трассировка запуска:"]
+        for name, depth, duration in self.phases:
+            shown = "..." if duration is None else f"{duration * 1000:8.1f} мс"
+            lines.append(f"  {'  ' * depth}{name}: {shown}")
+        for name, moment in self.marks:
+            lines.append(f"  [{moment * 1000:8.1f} мс от начала] {name}")
+        heavy = self.heavy_modules()
+        if heavy:
+            lines.append(f"  Загружены модули экспорта: {', '.join(heavy)}")
+        return "\n".join(lines)
+
+    def as_json(self):
+        return json.dumps({
+            "phases": [{"name": name, "depth": depth, "seconds": duration}
+                       for name, depth, duration in self.phases],
+            "marks": {name: moment for name, moment in self.marks},
+            "heavy_modules": self.heavy_modules(),
+        }, ensure_ascii=False)
+
+    def print_report(self):
+        print(self.report(), file=sys.stderr)
+
+
+# Общий экземпляр; отсчёт начинается с первого импорта модуля (первая строка main.py)
+trace = StartupTrace()
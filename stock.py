@@ -0,0 +1,160 @@
+from database import chunked, placeholders, COMPLETED_STATUS, CANCELLED_STATUS, STOCK_RESERVED, STOCK_COMMITTED, STOCK_RELEASED
+
+# Складской учёт заказов. У товара два счётчика: quantity - физический остаток на складе,
+# reserved - сколько из него удерживают незавершённые заказы; доступно для новых заказов quantity - reserved.
+# Заказ удерживает свой товар в одном из состояний: reserved (резерв), committed (списан со склада)
+# или released (не удерживается). Все изменения выполняются внутри транзакции вызывающего (tx).
+
+# Сколько единиц товара заказа в данном состоянии учтено в счётчиках товара: (quantity, reserved)
+HOLDINGS = {
+    STOCK_RESERVED: (0, 1),
+    STOCK_COMMITTED: (-1, 0),
+    STOCK_RELEASED: (0, 0),
+}
+
+
+class InsufficientStockError(Exception):
+    """ Недостаточно товара на складе (или товар не найден) для позиции заказа. """
+
+    def __init__(self, product_id):
+        super().__init__(f"Недостаточно товара на складе для продукта ID {product_id}.")
+        self.product_id = product_id
+
+
+class ReservedStockError(Exception):
+    """ Остаток товара нельзя сделать меньше количества, зарезервированного незавершёнными заказами. """
+
+    def __init__(self, product_id, reserved):
+        super().__init__(f"Остаток продукта ID {product_id} не может быть меньше "
+                         f"зарезервированного заказами количества ({reserved}).")
+        self.product_id = product_id
+        self.reserved = reserved
+
+
+def update_product(tx, product_id, name, price, quantity):
+    """
+    Изменяет название, цену и физический остаток товара.
+    Остаток проверяется в самом UPDATE (WHERE reserved <= ?), поэтому резерв, появившийся
+    одновременно с правкой, не окажется больше остатка.
+    :raises ReservedStockError: если quantity меньше зарезервированного количества
+    """
+    updated = tx.execute("UPDATE products SET name = ?, price = ?, quantity = ? WHERE id = ? AND reserved <= ?",
+                         (name, price, quantity, product_id, quantity)).rowcount
+    if updated == 0:
+        row = tx.fetch_one("SELECT reserved FROM products WHERE id = ?", (product_id,))
+        if row is not None:
+            raise ReservedStockError(product_id, row[0])
+
+
+def state_for_status(status):
+    """ Состояние товара, соответствующее статусу заказа. """
+    if status == COMPLETED_STATUS:
+        return STOCK_COMMITTED
+    if status == CANCELLED_STATUS:
+        return STOCK_RELEASED
+    return STOCK_RESERVED
+
+
+def held_quantities(tx, order_ids):
+    """
+    Товар, удерживаемый заказами, по состояниям: {состояние: {id товара: общее количество}}.
+    Читается запросами с GROUP BY по ID_CHUNK_SIZE заказов.
+    """
+    held = {}
+    for chunk in chunked(order_ids):
+        for state, product_id, quantity in tx.fetch_all(f"""
+            SELECT orders.stock_state, order_items.product_id, SUM(order_items.quantity)
+            FROM orders
+            JOIN order_items ON order_items.order_id = orders.id
+            WHERE orders.id IN ({placeholders(chunk)})
+            GROUP BY orders.stock_state, order_items.product_id
+        """, chunk):
+            quantities = held.setdefault(state, {})
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return held
+
+
+def move_stock(tx, quantities, from_state, to_state):
+    """
+    Переводит товар заказа из состояния from_state в to_state (см. change_holding).
+    :param quantities: {id товара: количество}
+    """
+    if from_state != to_state:
+        change_holding(tx, quantities, from_state, quantities, to_state)
+
+
+def change_holding(tx, old_quantities, old_state, new_quantities, new_state):
+    """
+    Заменяет товар, удерживаемый заказом (old_quantities в состоянии old_state), на new_quantities
+    в состоянии new_state. Для каждого товара применяется только итоговое изменение счётчиков,
+    поэтому товары, количество и состояние которых не изменились, не затрагиваются.
+    :param old_quantities, new_quantities: {id товара: количество}
+    :raises InsufficientStockError: если товара нет или свободного остатка не хватает;
+                                    транзакция вызывающего должна быть отменена.
+    """
+    deltas = {}
+    add_holding(deltas, old_quantities, old_state, -1)
+    add_holding(deltas, new_quantities, new_state, 1)
+    apply_stock_deltas(tx, deltas)
+
+
+def add_holding(deltas, quantities, state, sign):
+    """
+    Добавляет к изменениям счётчиков deltas ({id товара: (изменение quantity, изменение reserved)})
+    товар quantities в состоянии state: sign=1 - заказ начинает его удерживать, sign=-1 - перестаёт.
+    """
+    quantity_unit, reserved_unit = HOLDINGS[state]
+    for product_id, quantity in quantities.items():
+        quantity_delta, reserved_delta = deltas.get(product_id, (0, 0))
+        deltas[product_id] = (quantity_delta + sign * quantity_unit * quantity,
+                              reserved_delta + sign * reserved_unit * quantity)
+
+
+def apply_stock_deltas(tx, deltas):
+    """
+    Применяет изменения счётчиков товаров {id товара: (изменение quantity, изменение reserved)}.
+    Изменения, уменьшающие свободный остаток (quantity - reserved), выполняются условным
+    UPDATE ... WHERE quantity - reserved >= ?, поэтому проверка и списание неразделимы
+    и одновременные заказы не могут продать больше, чем есть на складе. Остальные
+    изменения выполняются одним executemany. Условные UPDATE тоже отправляются одним executemany;
+    если изменено меньше строк, чем товаров, изменения откатываются и ищется товар, которого не хватило.
+    :raises InsufficientStockError: если товара нет или свободного остатка не хватает
+    """
+    unchecked, checked = [], []
+    for product_id, (quantity_delta, reserved_delta) in deltas.items():
+        taken = reserved_delta - quantity_delta  # На сколько уменьшается свободный остаток
+        if quantity_delta == 0 and reserved_delta == 0:
+            continue
+        if taken > 0:
+            checked.append((quantity_delta, reserved_delta, product_id, taken))
+        else:
+            unchecked.append((quantity_delta, reserved_delta, product_id))
+
+    if unchecked:
+        tx.executemany("UPDATE products SET quantity = quantity + ?, reserved = reserved + ? WHERE id = ?",
+                       unchecked)
+    if checked:
+        # Точка сохранения позволяет при нехватке вернуть счётчики и найти товар по исходным остаткам
+        tx.execute("SAVEPOINT stock_check")
+        updated = tx.executemany("""
+            UPDATE products SET quantity = quantity + ?, reserved = reserved + ?
+            WHERE id = ? AND quantity - reserved >= ?
+        """, checked).rowcount
+        if updated != len(checked):
+            tx.execute("ROLLBACK TO stock_check")
+            tx.execute("RELEASE stock_check")
+            raise InsufficientStockError(_failed_product(tx, checked))
+        tx.execute("RELEASE stock_check")
+
+
+def _failed_product(tx, checked):
+    """ Первый товар, которого нет или свободного остатка которого меньше требуемого. """
+    product_ids = [product_id for _, _, product_id, _ in checked]
+    free = {}
+    for chunk in chunked(product_ids):
+        free.update(tx.fetch_all(f"SELECT id, quantity - reserved FROM products WHERE id IN ({placeholders(chunk)})",
+                                 chunk))
+    for _, _, product_id, taken in checked:
+        if free.get(product_id, 0) < taken:
+            return product_id
+    return product_ids[0]
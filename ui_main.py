@@ -1,14 +1,23 @@
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
-    QPushButton, QTableWidget, QTableWidgetItem, QDialog, QComboBox,
-    QLineEdit, QLabel, QDialogButtonBox, QMessageBox
+    QPushButton, QTableWidget, QTableWidgetItem, QTableView, QDialog, QComboBox,
+    QLineEdit, QLabel, QDialogButtonBox, QMessageBox, QListView, QSpinBox, QFileDialog, QAbstractItemView
 )
 from PyQt6.QtGui import QIntValidator
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from database import Database
 from ui_products import AddProductDialog
-from export_to_excel import ExportToExcelDialog
+from orders_model import OrdersTableModel, OrdersLoader
+from product_models import ProductSearchModel, ProductListModel
+from stock import ReservedStockError, update_product
+from order_service import (create_order, set_order_status, set_orders_status, update_order, delete_order,
+                           delete_orders, InsufficientStockError)
+from product_import import import_products
+from workers import start_job
+from startup_trace import trace
 
+# Статусы, которые можно выбрать при редактировании заказа
+ORDER_STATUSES = ["В процессе", "завершено", "отменено"]
 
 
 class MainApp(QMainWindow):
@@ -31,17 +40,24 @@ class MainApp(QMainWindow):
         self.setStyleSheet("""
             QWidget { background-color: #D7EAD7; }
             QPushButton { background-color: #B2EBF2; color: black; }
-            QTableWidget { background-color: #D7EAD7; }
+            QTableView { background-color: #D7EAD7; }
             QLabel { color: black; }
             QLineEdit { background-color: #F1F4F1; }
         """)
 
-        self.orders_table = QTableWidget()
-        self.orders_table.setColumnCount(7)  # Увеличиваем количество колонок на 1
-        self.orders_table.setHorizontalHeaderLabels(["Имя заказчика", "Номер заказа", "Товар", "Количество", "Цена", "Статус", "Время создания"])  # Добавляем заголовок для времени создания
+        # Таблица заказов работает через модель: ячейки вычисляются только для видимых строк
+        self.orders_loader = OrdersLoader(self.db, None if self.role == 'admin' else self.user_id)
+        self.orders_model = OrdersTableModel(self.orders_loader, self)
+        self.journal_position = 0  # Последняя учтённая запись журнала изменений заказов
+        self.orders_table = QTableView()
+        self.orders_table.setModel(self.orders_model)
+        # Можно выделить несколько заказов (Ctrl/Shift) для групповой смены статуса и удаления
+        self.orders_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.orders_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.layout.addWidget(self.orders_table)
 
-        self.update_orders_list()
+        with trace.phase("первая загрузка заказов"):
+            self.update_orders_list()
 
         # Кнопки управления
         self.add_order_button = QPushButton("Добавить заказ")
@@ -56,18 +72,32 @@ class MainApp(QMainWindow):
         self.manage_products_button = QPushButton("Управление товарами")
         self.manage_products_button.clicked.connect(self.manage_products)
 
+        # Групповые операции над выделенными в таблице заказами
+        self.bulk_layout = QHBoxLayout()
+        self.bulk_status_combobox = QComboBox()
+        self.bulk_status_combobox.addItems(ORDER_STATUSES)
+        self.bulk_status_button = QPushButton("Установить статус выделенным")
+        self.bulk_status_button.clicked.connect(self.change_selected_orders_status)
+        self.bulk_delete_button = QPushButton("Удалить выделенные заказы")
+        self.bulk_delete_button.clicked.connect(self.delete_selected_orders)
+        self.bulk_layout.addWidget(self.bulk_status_combobox)
+        self.bulk_layout.addWidget(self.bulk_status_button)
+        self.bulk_layout.addWidget(self.bulk_delete_button)
+
         # Добавляем кнопки только если пользователь - администратор
         if self.role == 'admin':
             self.layout.addWidget(self.add_order_button)
             self.layout.addWidget(self.edit_order_button)
             self.layout.addWidget(self.delete_order_button)
+            self.layout.addLayout(self.bulk_layout)
             self.layout.addWidget(self.manage_products_button)
 
         # Кнопка обновления таблицы
         self.refresh_button = QPushButton("Обновить таблицу")
-        self.refresh_button.clicked.connect(self.update_orders_list)
+        self.refresh_button.clicked.connect(self.refresh_changed_orders)
         self.layout.addWidget(self.refresh_button, alignment=Qt.AlignmentFlag.AlignRight)  # Выравнивание по правому краю
 
+        self.export_dialog = None  # Создаётся при первом открытии
         self.export_button = QPushButton("Экспорт в Excel")
         self.export_button.clicked.connect(self.open_export_dialog)
         self.layout.addWidget(self.export_button, alignment=Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignBottom)
@@ -75,8 +105,26 @@ class MainApp(QMainWindow):
         container.setLayout(self.layout)
 
     def open_export_dialog(self):
-        dialog = ExportToExcelDialog(self.db)
-        dialog.exec()
+        # Окно немодальное: пока отчёт формируется, можно продолжать работать с заказами.
+        # Ссылка хранится, чтобы окно и его фоновая задача жили и после закрытия окна.
+        if self.export_dialog is None:
+            # Модуль экспорта загружается при первом открытии окна, чтобы не замедлять запуск
+            from export_to_excel import ExportToExcelDialog
+
+            self.export_dialog = ExportToExcelDialog(self.db, self)
+            self.export_dialog.export_finished.connect(self.on_export_finished)
+        self.export_dialog.show()
+        self.export_dialog.raise_()
+        self.export_dialog.activateWindow()
+
+    def on_export_finished(self, filepath):
+        QMessageBox.information(self, "Успех", f"Данные успешно экспортированы в {filepath}.")
+
+    def closeEvent(self, event):
+        # Незавершённый экспорт отменяется, чтобы приложение не ждало его при выходе
+        if self.export_dialog is not None:
+            self.export_dialog.cancel_export()
+        super().closeEvent(event)
 
     def on_add_order_button_click(self):
         try:
@@ -89,9 +137,8 @@ class MainApp(QMainWindow):
 
                 # Добавляем заказ
                 self.add_order(self.user_id, order_items)
-                self.db.conn.commit()  # Подтверждаем изменения в БД
 
-                self.update_orders_list()  # Обновляем таблицу заказов
+                self.refresh_changed_orders()  # Обновляем изменённые заказы в таблице
                 QMessageBox.information(self, "Успех", "Заказ успешно добавлен.")
         except Exception as e:
             print(f"Ошибка: {e}")
@@ -100,141 +147,83 @@ class MainApp(QMainWindow):
     def load_orders(self):
         """ Загружает заказы из базы данных и обновляет таблицу. """
         try:
-            orders = self.db.fetch_all(""" 
-                SELECT o.id, u.username AS customer_name, 
-                       p.name AS product_name,
-                       oi.quantity,
-                       (oi.quantity * p.price) AS total_price,
-                       o.status,
-                       o.created_at  -- Добавляем время создания заказа
-                FROM orders o
-                JOIN order_items oi ON o.id = oi.order_id
-                JOIN products p ON oi.product_id = p.id
-                JOIN users u ON o.user_id = u.id
-            """)
-
-            self.orders_table.setRowCount(len(orders))  # Устанавливаем количество строк в таблице
-
-            for row, (order_id, customer_name, product_name, quantity, total_price, status, created_at) in enumerate(
-                    orders):
-                self.orders_table.setItem(row, 0, QTableWidgetItem(customer_name))  # Имя заказчика
-                self.orders_table.setItem(row, 1, QTableWidgetItem(str(order_id)))  # ID заказа
-                self.orders_table.setItem(row, 2, QTableWidgetItem(product_name))  # Название товара
-                self.orders_table.setItem(row, 3, QTableWidgetItem(str(quantity)))  # Количество товара
-                self.orders_table.setItem(row, 4, QTableWidgetItem(f"{total_price:.2f}"))  # Общая сумма за товар
-                self.orders_table.setItem(row, 5, QTableWidgetItem(status))  # Статус заказа
-                self.orders_table.setItem(row, 6, QTableWidgetItem(created_at))  # Время создания заказа
-
+            self.update_orders_list()
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Ошибка загрузки заказов: {e}")
 
     def update_orders_list(self):
-        # Очищаем таблицу перед обновлением
-        self.orders_table.setRowCount(0)
+        """ Полностью перечитывает заказы (при открытии окна или если журнал изменений уже очищен). """
+        # Позицию журнала запоминаем до запроса: изменения, сделанные во время чтения, будут применены повторно
+        self.journal_position = self.db.last_order_change()
+        # Загружается только первая порция заказов, остальные подгружаются при прокрутке таблицы
+        self.orders_model.reload()
+
+    def refresh_changed_orders(self):
+        """ Перечитывает только заказы, изменённые после последнего обновления таблицы. """
+        changes = self.db.fetch_order_changes(self.journal_position)
+        if changes is None:
+            self.update_orders_list()
+            return
 
-        # Формируем запрос в зависимости от роли пользователя
-        if self.role == 'admin':
-            query = """ 
-                SELECT 
-                    orders.id,
-                    orders.order_number, 
-                    users.username, 
-                    GROUP_CONCAT(products.name || '|' || order_items.quantity || '|' || order_items.price, '\n') AS product_list, 
-                    SUM(order_items.quantity) AS total_quantity,
-                    SUM(order_items.price) AS total_price,
-                    orders.status,
-                    orders.created_at  -- Добавляем время создания заказа
-                FROM orders
-                JOIN users ON orders.user_id = users.id
-                JOIN order_items ON order_items.order_id = orders.id
-                JOIN products ON order_items.product_id = products.id
-                GROUP BY orders.id
-            """
-            orders = self.db.fetch_all(query)
-        else:
-            query = """ 
-                SELECT 
-                    orders.id,
-                    orders.order_number, 
-                    users.username, 
-                    GROUP_CONCAT(products.name || '|' || order_items.quantity || '|' || order_items.price, '\n') AS product_list, 
-                    SUM(order_items.quantity) AS total_quantity,
-                    SUM(order_items.price) AS total_price,
-                    orders.status,
-                    orders.created_at  -- Добавляем время создания заказа
-                FROM orders
-                JOIN users ON orders.user_id = users.id
-                JOIN order_items ON order_items.order_id = orders.id
-                JOIN products ON order_items.product_id = products.id
-                WHERE users.id = ?
-                GROUP BY orders.id
-            """
-            orders = self.db.fetch_all(query, (self.user_id,))
-
-        # Перебор заказов и добавление данных в таблицу
-        for order in orders:
-            order_id, order_number, username, product_list, total_quantity, total_price, status, created_at = order
-
-            # Добавляем строку с данными о заказе
-            main_row = self.orders_table.rowCount()
-            self.orders_table.insertRow(main_row)
-
-            # Заполняем данные о заказе
-            self.orders_table.setItem(main_row, 0, QTableWidgetItem(username))  # Имя заказчика
-            self.orders_table.setItem(main_row, 1, QTableWidgetItem(order_number))  # Номер заказа
-            self.orders_table.setItem(main_row, 2, QTableWidgetItem(""))  # Пусто
-            self.orders_table.setItem(main_row, 3, QTableWidgetItem(str(total_quantity)))  # Общее количество
-            self.orders_table.setItem(main_row, 4, QTableWidgetItem(f"{total_price:.2f}₽"))  # Общая цена
-            self.orders_table.setItem(main_row, 5, QTableWidgetItem(status))  # Статус заказа
-            self.orders_table.setItem(main_row, 6, QTableWidgetItem(created_at))  # Время создания заказа
-
-            # Добавление строк для продуктов в заказе
-            if product_list:
-                products = product_list.split('\n')
-                for product_details in products:
-                    product_name, quantity, price = product_details.split('|')
-                    quantity = int(quantity)
-                    price = float(price)
-
-                    details_row = self.orders_table.rowCount()
-                    self.orders_table.insertRow(details_row)
-
-                    # Заполняем только данные о товаре
-                    self.orders_table.setItem(details_row, 0, QTableWidgetItem(""))  # Пусто
-                    self.orders_table.setItem(details_row, 1, QTableWidgetItem(""))  # Пусто
-                    self.orders_table.setItem(details_row, 2, QTableWidgetItem(product_name))  # Название товара
-                    self.orders_table.setItem(details_row, 3, QTableWidgetItem(str(quantity)))  # Количество товара
-                    self.orders_table.setItem(details_row, 4, QTableWidgetItem(f"{price:.2f}₽"))  # Цена товара
-                    self.orders_table.setItem(details_row, 5, QTableWidgetItem(""))  # Пусто
-
-                # Устанавливаем время создания только для первой строки
-                self.orders_table.setItem(main_row, 6, QTableWidgetItem(created_at))  # Время создания заказа
-                # Оставляем пустыми строки с товарами
-                for i in range(1, len(products) + 1):
-                    self.orders_table.setItem(main_row + i, 6, QTableWidgetItem(""))  # Пусто для строк с товарами
+        self.journal_position, order_ids = changes
+        if order_ids:
+            self.orders_model.refresh_orders(order_ids)
 
     def update_order_status(self, order_id, new_status):
         """Обновляет статус заказа в базе данных."""
-        query = "UPDATE orders SET status = ? WHERE id = ?"
         try:
-            # Получаем текущие товары в заказе
-            current_order_items = self.db.fetch_all("SELECT product_id, quantity FROM order_items WHERE order_id = ?",
-                                                    (order_id,))
+            # Статус и складской учёт меняются одной транзакцией: резерв списывается при завершении
+            # и снимается при отмене, повторного списания не происходит
+            set_order_status(self.db, order_id, new_status)
+            print(f"Статус заказа {order_id} обновлён на {new_status}")
+        except InsufficientStockError as e:
+            QMessageBox.warning(self, "Недостаточно товара", str(e))
+        except Exception as e:
+            print(f"Ошибка обновления статуса заказа: {e}")
 
-            # Обновляем статус заказа
-            self.db.query(query, (new_status, order_id))
+    def selected_order_ids(self):
+        """ id заказов, строки которых выделены в таблице (каждый заказ - один раз, в порядке таблицы). """
+        rows = sorted(index.row() for index in self.orders_table.selectionModel().selectedRows())
+        return list(dict.fromkeys(self.orders_model.order_id_at(row) for row in rows))
 
-            if new_status == "завершено":
-                # Если статус изменен на "завершено", обновляем количество товара на складе
-                for product_id, quantity in current_order_items:
-                    self.db.query("UPDATE products SET quantity = quantity - ? WHERE id = ?",
-                                  (quantity, product_id))  # Вычитаем количество
+    def change_selected_orders_status(self):
+        order_ids = self.selected_order_ids()
+        if not order_ids:
+            QMessageBox.warning(self, "Нет выбора", "Выделите заказы в таблице.")
+            return
 
-            self.db.conn.commit()  # Подтверждаем изменения в БД
-            print(f"Статус заказа {order_id} обновлён на {new_status}")
+        status = self.bulk_status_combobox.currentText()
+        try:
+            # Все заказы и складской учёт меняются одной транзакцией
+            changed = set_orders_status(self.db, order_ids, status)
+        except InsufficientStockError as e:
+            QMessageBox.warning(self, "Недостаточно товара", f"{e}\nСтатусы заказов не изменены.")
+            return
         except Exception as e:
-            self.db.conn.rollback()
-            print(f"Ошибка обновления статуса заказа: {e}")
+            QMessageBox.critical(self, "Ошибка", f"Ошибка изменения статуса заказов: {e}")
+            return
+        self.refresh_changed_orders()
+        QMessageBox.information(self, "Успех", f"Статус \"{status}\" установлен заказам: {changed}.")
+
+    def delete_selected_orders(self):
+        order_ids = self.selected_order_ids()
+        if not order_ids:
+            QMessageBox.warning(self, "Нет выбора", "Выделите заказы в таблице.")
+            return
+
+        reply = QMessageBox.question(self, "Подтверждение удаления",
+                                     f"Удалить выделенные заказы ({len(order_ids)})?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+
+        try:
+            deleted = delete_orders(self.db, order_ids)  # Резерв товара снимается вместе с заказами
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Ошибка удаления заказов: {e}")
+            return
+        self.refresh_changed_orders()
+        QMessageBox.information(self, "Заказы удалены", f"Удалено заказов: {deleted}.")
 
     def toggle(self, row: int, product_count: int):
         """
@@ -246,7 +235,7 @@ class MainApp(QMainWindow):
         is_expanded = self.orders_table.rowSpan(row, 0) > 1
 
         # Меняем текст кнопки
-        button = self.orders_table.cellWidget(row, 4)
+        button = self.orders_table.indexWidget(self.orders_model.index(row, 4))
         if button:  # Проверяем, что кнопка существует
             button.setText("Развернуть" if is_expanded else "Свернуть")
 
@@ -283,7 +272,7 @@ class MainApp(QMainWindow):
             self.orders_table.setRowHidden(details_row, is_expanded)
 
         # Обновляем текст кнопки
-        button = self.orders_table.cellWidget(order_row, 3)
+        button = self.orders_table.indexWidget(self.orders_model.index(order_row, 3))
         if is_expanded:
             button.setText("Свернуть")
         else:
@@ -293,59 +282,19 @@ class MainApp(QMainWindow):
         try:
             print(f"Добавление заказа для пользователя {user_id}, товары: {order_items}")
 
-            # Проверка наличия товара на складе
-            for product_id, quantity in order_items:
-                stock_quantity = self.db.fetch_one("SELECT quantity FROM products WHERE id = ?", (product_id,))
-                if stock_quantity is None or stock_quantity[0] < quantity:
-                    QMessageBox.warning(self, "Недостаточно товара", f"Недостаточно товара на складе для продукта ID {product_id}.")
-                    return  # Прерываем выполнение, если товара недостаточно
-
-            # Генерация номера заказа
-            order_number_query = "SELECT COUNT(*) FROM orders"
-            order_count = self.db.fetch_one(order_number_query)[0]
-            order_number = f"ORD-{order_count + 1}"
-
-            # Начинаем транзакцию для добавления заказа
-            self.db.query("INSERT INTO orders (user_id, order_number, status) VALUES (?, ?, ?)",
-                          (user_id, order_number, "Ожидание"))
-
-            # Получаем ID только что добавленного заказа
-            order_id = self.db.fetch_one("SELECT id FROM orders WHERE order_number = ?", (order_number,))[0]
-
-            total_quantity = 0
-            total_price = 0.0
-
-            # Добавление товаров в заказ
-            for product_id, quantity in order_items:
-                # Получаем цену товара
-                price = self.db.fetch_one("SELECT price FROM products WHERE id = ?", (product_id,))
-
-                if price is None:
-                    print(f"Товар с ID {product_id} не найден.")
-                    continue
-
-                price = price[0]  # Извлекаем цену
-
-                # Добавляем товар в таблицу order_items
-                self.db.query("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
-                              (order_id, product_id, quantity, price * quantity))
-
-                total_quantity += quantity
-                total_price += price * quantity
-
-                # Обновляем количество товара на складе
-                self.db.query("UPDATE products SET quantity = quantity - ? WHERE id = ?", (quantity, product_id))
+            # Проверка наличия, запись заказа и списание со склада - одной транзакцией
+            try:
+                order_id, order_number = create_order(self.db, user_id, order_items)
+            except InsufficientStockError as e:
+                QMessageBox.warning(self, "Недостаточно товара", str(e))
+                return  # Прерываем выполнение, если товара недостаточно
 
-            # Фиксируем изменения в базе данных
-            self.db.conn.commit()
             print(f"Заказ {order_number} успешно добавлен для пользователя {user_id}")
 
             # Обновляем таблицу заказов
-            self.update_orders_list()  # Обновляем таблицу после добавления заказа
+            self.refresh_changed_orders()  # Обновляем таблицу после добавления заказа
 
         except Exception as e:
-            # Откат транзакции в случае ошибки
-            self.db.conn.rollback()
             print(f"Ошибка добавления заказа: {e}")
             raise e
 
@@ -355,30 +304,15 @@ class MainApp(QMainWindow):
         if select_order_dialog.exec() == QDialog.DialogCode.Accepted:
             order_id = select_order_dialog.get_selected_order_id()  # Получаем ID выбранного заказа
             if order_id:
-                # Получаем текущие товары в заказе
-                current_order_items = self.db.fetch_all(
-                    "SELECT product_id, quantity FROM order_items WHERE order_id = ?", (order_id,))
-                # Открываем диалог редактирования
+                # Открываем диалог редактирования; складской учёт выполняет сам диалог (order_service.update_order)
                 dialog = EditOrderDialog(self.db, order_id)
                 if dialog.exec() == QDialog.DialogCode.Accepted:
-                    # Получаем новые товары в заказе
-                    new_order_items = dialog.get_order_items()  # Получаем новые товары
-
-                    # Обновляем количество товара на складе
-                    for product_id, quantity in current_order_items:
-                        self.db.query("UPDATE products SET quantity = quantity + ? WHERE id = ?",
-                                      (quantity, product_id))  # Возвращаем старое количество
-
-                    for product_id, quantity in new_order_items:
-                        self.db.query("UPDATE products SET quantity = quantity - ? WHERE id = ?",
-                                      (quantity, product_id))  # Вычитаем новое количество
-
-                    self.update_orders_list()  # Обновляем список заказов после редактирования
+                    self.refresh_changed_orders()  # Обновляем список заказов после редактирования
 
     def delete_order(self):
         dialog = DeleteOrderDialog(self.db)
         if dialog.exec() == QDialog.DialogCode.Accepted:
-            self.update_orders_list()
+            self.refresh_changed_orders()
             QMessageBox.information(self, "Заказ удалён", "Заказ успешно удалён!")
 
     def manage_products(self):
@@ -403,8 +337,10 @@ class ManageProductsDialog(QDialog):
         self.layout = QVBoxLayout()
 
         self.products_table = QTableWidget()
-        self.products_table.setColumnCount(4)
-        self.products_table.setHorizontalHeaderLabels(["ID", "Название товара", "Цена (руб.)", "Остаток товара на складе"])  # Изменено название столбца
+        # Остаток - физическое количество на складе, часть его может быть зарезервирована заказами
+        self.products_table.setColumnCount(6)
+        self.products_table.setHorizontalHeaderLabels(["ID", "Название товара", "Цена (руб.)", "Остаток на складе",
+                                                       "Зарезервировано", "Доступно"])
         self.layout.addWidget(self.products_table)
 
         self.add_product_button = QPushButton("Добавить товар")
@@ -419,11 +355,25 @@ class ManageProductsDialog(QDialog):
         self.delete_product_button.clicked.connect(self.delete_selected_product)
         self.layout.addWidget(self.delete_product_button)
 
+        # Импорт прайс-листа выполняется в фоновом потоке (product_import.import_products)
+        self.import_job = None
+        self.import_button = QPushButton("Импортировать прайс-лист (CSV, XLSX)")
+        self.import_button.clicked.connect(self.import_price_list)
+        self.layout.addWidget(self.import_button)
+
+        self.cancel_import_button = QPushButton("Отменить импорт")
+        self.cancel_import_button.clicked.connect(self.cancel_import)
+        self.cancel_import_button.setEnabled(False)
+        self.layout.addWidget(self.cancel_import_button)
+
+        self.import_label = QLabel("")
+        self.layout.addWidget(self.import_label)
+
         self.load_products()
         self.setLayout(self.layout)
 
     def load_products(self):
-        products = self.db.fetch_all("SELECT id, name, price, quantity FROM products")
+        products = self.db.fetch_all("SELECT id, name, price, quantity, reserved, quantity - reserved FROM products")
         self.products_table.setRowCount(len(products))
 
         for row, product in enumerate(products):
@@ -465,8 +415,67 @@ class ManageProductsDialog(QDialog):
         else:
             QMessageBox.warning(self, "Нет выбранного элемента", "Пожалуйста, выберите продукт для удаления.")
 
+    def import_price_list(self):
+        if self.import_job is not None:
+            return
+
+        filepath, _ = QFileDialog.getOpenFileName(self, "Импорт прайс-листа", "",
+                                                  "Прайс-листы (*.csv *.xlsx);;CSV (*.csv);;Excel (*.xlsx)")
+        if not filepath:
+            return
+
+        self.import_button.setEnabled(False)
+        self.cancel_import_button.setEnabled(True)
+        self.import_label.setText("Импорт...")
+        self.import_job = start_job(import_products, self.db, filepath,
+                                    on_finished=self.on_import_finished, on_failed=self.on_import_failed,
+                                    on_progress=self.on_import_progress, on_cancelled=self.on_import_cancelled)
+
+    def cancel_import(self):
+        if self.import_job is not None:
+            self.import_job.cancel()
+            self.cancel_import_button.setEnabled(False)
+            self.import_label.setText("Отмена импорта...")
+
+    def on_import_progress(self, status):
+        self.import_label.setText(f"Прочитано строк: {status.rows}, добавлено: {status.inserted}, "
+                                  f"обновлено: {status.updated}, ошибок: {status.errors}")
+
+    def on_import_finished(self, result):
+        self._finish_import()
+        self.import_label.setText("")
+        message = (f"Добавлено товаров: {result.inserted}\nОбновлено: {result.updated}\n"
+                   f"Без изменений: {result.unchanged}\nСтрок с ошибками: {result.error_count}")
+        if result.errors:
+            message += "\n\n" + "\n".join(result.errors[:20])
+        QMessageBox.information(self, "Импорт завершён", message)
+
+    def on_import_failed(self, error):
+        self._finish_import()
+        self.import_label.setText("")
+        QMessageBox.critical(self, "Ошибка", f"Не удалось импортировать прайс-лист: {str(error)}")
+
+    def on_import_cancelled(self):
+        self._finish_import()
+        self.import_label.setText("Импорт отменён, уже записанные товары сохранены.")
+
+    def _finish_import(self):
+        self.import_job = None
+        self.import_button.setEnabled(True)
+        self.cancel_import_button.setEnabled(False)
+        self.refresh_products()
+
+    def done(self, result):
+        # Закрытие окна останавливает импорт в ближайшей точке проверки
+        if self.import_job is not None:
+            self.import_job.cancel()
+        super().done(result)
+
 
 class AddOrderDialog(QDialog):
+    # Пауза в наборе текста перед поиском товаров, мс
+    SEARCH_DELAY_MS = 250
+
     def __init__(self, db, user_id, parent=None):
         super().__init__(parent)
         self.db = db
@@ -498,36 +507,100 @@ class AddOrderDialog(QDialog):
         self.layout.addWidget(QLabel("Выберите пользователя:"))
         self.layout.addWidget(self.user_combobox)
 
-        # Таблица товаров
+        # Поиск товара: запрос выполняется после паузы в наборе (SEARCH_DELAY_MS), в списке -
+        # только найденные товары, поэтому окно не загружает весь каталог
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Название товара")
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.search_products)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.search_input.returnPressed.connect(self.search_products)
+        self.layout.addWidget(QLabel("Найдите товар:"))
+        self.layout.addWidget(self.search_input)
+
+        self.search_model = ProductSearchModel(self.db.catalog, self)
+        self.search_results = QListView()
+        self.search_results.setModel(self.search_model)
+        self.search_results.doubleClicked.connect(self.add_selected_product)
+        self.layout.addWidget(self.search_results)
+
+        add_layout = QHBoxLayout()
+        self.quantity_input = QSpinBox()
+        self.quantity_input.setRange(1, 1000000)
+        add_layout.addWidget(QLabel("Количество:"))
+        add_layout.addWidget(self.quantity_input)
+        self.add_product_button = QPushButton("Добавить в заказ")
+        self.add_product_button.clicked.connect(self.add_selected_product)
+        add_layout.addWidget(self.add_product_button)
+        self.layout.addLayout(add_layout)
+
+        # Товары заказа; id товара хранится в данных ячейки названия
         self.products_table = QTableWidget()
         self.products_table.setColumnCount(2)
-        self.products_table.setHorizontalHeaderLabels(["ID Товара", "Количество"])
-        self.layout.addWidget(QLabel("Добавьте товары:"))
+        self.products_table.setHorizontalHeaderLabels(["Товар", "Количество"])
+        self.layout.addWidget(QLabel("Товары заказа:"))
         self.layout.addWidget(self.products_table)
 
+        self.remove_product_button = QPushButton("Удалить выбранный товар")
+        self.remove_product_button.clicked.connect(self.remove_selected_product)
+        self.layout.addWidget(self.remove_product_button)
+
         # Кнопки подтверждения
         self.buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
         self.buttons.accepted.connect(self.accept)
         self.buttons.rejected.connect(self.reject)
         self.layout.addWidget(self.buttons)
 
-        self.load_products()
+        self.search_products()
 
-    def load_products(self):
+    def search_products(self):
         """
-        Загружаем товары из базы данных и заполняем таблицу.
+        Обновляет список найденных товаров по тексту поиска.
         """
+        self.search_timer.stop()
         try:
-            products = self.db.fetch_all("SELECT id, name, quantity FROM products")
-            if not products:
-                QMessageBox.warning(self, "Предупреждение", "Нет доступных товаров для добавления.")
-                return
-            self.products_table.setRowCount(len(products))
-            for row, (product_id, name, quantity) in enumerate(products):
-                self.products_table.setItem(row, 0, QTableWidgetItem(f"{product_id}: {name}"))
-                self.products_table.setItem(row, 1, QTableWidgetItem("0"))
+            self.search_model.search(self.search_input.text())
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Ошибка загрузки товаров: {e}")
+            QMessageBox.critical(self, "Ошибка", f"Ошибка поиска товаров: {e}")
+            return
+        if self.search_model.rowCount() > 0:
+            self.search_results.setCurrentIndex(self.search_model.index(0, 0))
+
+    def add_selected_product(self):
+        """
+        Добавляет выбранный в результатах поиска товар в заказ; повторный выбор увеличивает количество.
+        """
+        index = self.search_results.currentIndex()
+        if not index.isValid():
+            QMessageBox.warning(self, "Ошибка", "Выберите товар в результатах поиска.")
+            return
+
+        product = self.search_model.product(index.row())
+        quantity = self.quantity_input.value()
+        for row in range(self.products_table.rowCount()):
+            if self.products_table.item(row, 0).data(Qt.ItemDataRole.UserRole) == product.id:
+                quantity_item = self.products_table.item(row, 1)
+                try:
+                    quantity += int(quantity_item.text())
+                except ValueError:
+                    pass
+                quantity_item.setText(str(quantity))
+                return
+
+        row = self.products_table.rowCount()
+        self.products_table.insertRow(row)
+        name_item = QTableWidgetItem(product.name)
+        name_item.setData(Qt.ItemDataRole.UserRole, product.id)
+        name_item.setFlags(name_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+        self.products_table.setItem(row, 0, name_item)
+        self.products_table.setItem(row, 1, QTableWidgetItem(str(quantity)))
+
+    def remove_selected_product(self):
+        row = self.products_table.currentRow()
+        if row != -1:
+            self.products_table.removeRow(row)
 
     def get_selected_order_items(self):
         """
@@ -536,17 +609,16 @@ class AddOrderDialog(QDialog):
         """
         order_items = []
         for row in range(self.products_table.rowCount()):
-            product_id_item = self.products_table.item(row, 0)
+            product_item = self.products_table.item(row, 0)
             quantity_item = self.products_table.item(row, 1)
 
-            if not product_id_item or not quantity_item:
+            if not product_item or not quantity_item:
                 continue
 
             try:
-                product_id = int(product_id_item.text().split(":")[0])
                 quantity = int(quantity_item.text())
                 if quantity > 0:
-                    order_items.append((product_id, quantity))
+                    order_items.append((product_item.data(Qt.ItemDataRole.UserRole), quantity))
             except ValueError:
                 continue
 
@@ -568,7 +640,7 @@ class AddOrderDialog(QDialog):
             main_app.add_order(selected_user_id, order_items)
 
             # Обновляем таблицу заказов
-            main_app.load_orders()  # Добавьте этот вызов
+            main_app.refresh_changed_orders()
 
             self.close()  # Закрываем диалог
         except Exception as e:
@@ -591,7 +663,8 @@ class EditProductDialog(QDialog):
 
         self.layout = QVBoxLayout()
 
-        product = self.db.fetch_one("SELECT name, price, quantity FROM products WHERE id = ?", (self.product_id,))
+        product = self.db.fetch_one("SELECT name, price, quantity, reserved FROM products WHERE id = ?",
+                                    (self.product_id,))
 
         self.product_name_input = QLineEdit(product[0])
         self.product_price_input = QLineEdit(str(product[1]))
@@ -606,7 +679,7 @@ class EditProductDialog(QDialog):
         self.layout.addWidget(self.product_name_input)
         self.layout.addWidget(QLabel("Цена(рубли):"))
         self.layout.addWidget(self.product_price_input)
-        self.layout.addWidget(QLabel("Колличество:"))
+        self.layout.addWidget(QLabel(f"Колличество (зарезервировано заказами: {product[3]}):"))
         self.layout.addWidget(self.product_quantity_input)
 
         self.layout.addWidget(self.buttons)
@@ -618,8 +691,13 @@ class EditProductDialog(QDialog):
         quantity = self.product_quantity_input.text()
 
         if name and price and quantity.isdigit():
-            self.db.query("UPDATE products SET name = ?, price = ?, quantity = ? WHERE id = ?",
-                          (name, float(price), int(quantity), self.product_id))
+            # Остаток нельзя сделать меньше резерва незавершённых заказов
+            try:
+                with self.db.transaction() as tx:
+                    update_product(tx, self.product_id, name, float(price), int(quantity))
+            except ReservedStockError as e:
+                QMessageBox.warning(self, "Недостаточно товара", str(e))
+                return
             super().accept()
         else:
             QMessageBox.warning(self, "Вывод ошибки", "Пожалуйста заполните все правильно.")
@@ -745,14 +823,16 @@ class EditOrderDialog(QDialog):
 
         # Редактирование статуса заказа
         self.status_combobox = QComboBox()
-        self.status_combobox.addItems(["В процессе", "завершено", "отменено"])  # Пример статусов
+        self.status_combobox.addItems(ORDER_STATUSES)
         current_status = self.db.fetch_one("SELECT status FROM orders WHERE id = ?", (self.order_id,))
         if current_status:
             self.status_combobox.setCurrentText(current_status[0])
         self.layout.addWidget(QLabel("Статус заказа:"))
         self.layout.addWidget(self.status_combobox)
 
-        # Редактирование товаров заказа
+        # Редактирование товаров заказа; список товаров читается из каталога один раз
+        # и используется всеми строками как общая модель
+        self.product_model = ProductListModel(self.db.catalog.products(), self)
         self.items = []
         self.items_layout = QVBoxLayout()  # Новый layout для товаров
         order_items = self.db.fetch_all("SELECT product_id, quantity FROM order_items WHERE order_id = ?", (self.order_id,))
@@ -783,15 +863,11 @@ class EditOrderDialog(QDialog):
         """Добавляет элемент товара в список товаров заказа."""
         item_layout = QVBoxLayout()
         product_combobox = QComboBox()
-        products = self.db.fetch_all("SELECT id, name FROM products")
-        for product in products:
-            product_combobox.addItem(product[1], product[0])
+        product_combobox.setModel(self.product_model)
 
         # Если product_id не None, устанавливаем текущий индекс
         if product_id is not None:
-            product_combobox.setCurrentIndex(
-                next(i for i in range(product_combobox.count()) if product_combobox.itemData(i) == product_id)
-            )
+            product_combobox.setCurrentIndex(self.product_model.row_of(product_id))
 
         quantity_input = QLineEdit(str(quantity))
         quantity_input.setValidator(QIntValidator())
@@ -840,18 +916,12 @@ class EditOrderDialog(QDialog):
             QMessageBox.warning(self, "Ошибка", "Выберите пользователя.")
             return
 
-        # Обновление заказа
-        self.db.query("UPDATE orders SET user_id = ?, status = ? WHERE id = ?", (user_id, self.status_combobox.currentText(), self.order_id))
-        self.db.query("DELETE FROM order_items WHERE order_id = ?", (self.order_id,))
-
-        for product_combobox, quantity_input in self.items:
-            product_id = product_combobox.currentData()
-            quantity = quantity_input.text()
-            if product_id and quantity.isdigit() and int(quantity) > 0:
-                product = self.db.fetch_one("SELECT price FROM products WHERE id = ?", (product_id,))
-                price = product[0] * int(quantity)
-                self.db.query("INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
-                              (self.order_id, product_id, int(quantity), price))
+        # Обновление заказа и складского учёта (одной транзакцией)
+        try:
+            update_order(self.db, self.order_id, user_id, self.status_combobox.currentText(), self.get_order_items())
+        except InsufficientStockError as e:
+            QMessageBox.warning(self, "Недостаточно товара", str(e))
+            return
 
         QMessageBox.information(self, "Успех", "Заказ успешно отредактирован.")
         super().accept()
@@ -895,8 +965,7 @@ class DeleteOrderDialog(QDialog):
             QMessageBox.warning(self, "Ошибка", "Выберите заказ для удаления.")
             return
 
-        self.db.query("DELETE FROM order_items WHERE order_id = ?", (order_id,))
-        self.db.query("DELETE FROM orders WHERE id = ?", (order_id,))
+        delete_order(self.db, order_id)  # Резерв товара снимается вместе с заказом
         QMessageBox.information(self, "Успех", "Заказ успешно удалён.")
         super().accept()
 
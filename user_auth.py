@@ -1,30 +1,84 @@
+import os
+
 import bcrypt
 from database import Database
 
-def register_user(db, username, password, role):
+# Стоимость bcrypt (log2 числа раундов). Хэши с другой стоимостью пересчитываются при входе.
+BCRYPT_ROUNDS = int(os.environ.get("STORE_BCRYPT_ROUNDS", "12"))
+
+
+class AuthError(Exception):
+    """ Неверное имя пользователя или пароль. """
+
+
+def hash_password(password, rounds=None):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds or BCRYPT_ROUNDS))
+
+
+def verify_password(password, hashed_password):
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+def needs_rehash(hashed_password, rounds=None):
+    """ Проверяет, отличается ли стоимость хэша ($2b$<стоимость>$...) от настроенной. """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return int(hashed_password.split(b'$')[2]) != (rounds or BCRYPT_ROUNDS)
+
+
+def create_user(db, username, password, role, rounds=None):
+    """
+    Создаёт пользователя с хэшированным паролем.
+    :return: id нового пользователя
+    """
     if role not in ('admin', 'user'):
         raise ValueError("Invalid role. Must be 'admin' or 'user'.")
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed_password = hash_password(password, rounds)
+    return db.query("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                    (username, hashed_password, role)).lastrowid
+
+
+def authenticate(db, username, password, rounds=None):
+    """
+    Проверяет имя и пароль. Если хэш был создан с другой стоимостью,
+    он прозрачно пересчитывается с текущей (пароль известен только в этот момент).
+    :return: (id пользователя, роль)
+    :raises AuthError: если пользователь не найден или пароль неверный
+    """
+    user = db.fetch_one("SELECT id, password, role FROM users WHERE username = ?", (username,))
+    if not user:
+        raise AuthError("Пользователь не найден.")
+
+    user_id, hashed_password, role = user
+    if not verify_password(password, hashed_password):
+        raise AuthError("Неверный пароль.")
+
+    if needs_rehash(hashed_password, rounds):
+        db.query("UPDATE users SET password = ? WHERE id = ?", (hash_password(password, rounds), user_id))
+    return user_id, role
+
+
+def register_user(db, username, password, role):
+    if role not in ('admin', 'user'):
+        raise ValueError("Invalid role. Must be 'admin' or 'user'.")
 
     try:
-        db.query("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, hashed_password, role))
+        create_user(db, username, password, role)
         print(f"User {username} registered successfully as {role}.")
     except Exception as e:
         print(f"Error registering user: {e}")
 
 def login_user(db, username, password):
-    user = db.fetch_one("SELECT id, password, role FROM users WHERE username = ?", (username,))
-    if user:
-        user_id, hashed_password, role = user
-        if bcrypt.checkpw(password.encode('utf-8'), hashed_password):
-            print(f"Login successful. Welcome, {username}!")
-            return user_id, role
-        else:
-            print("Invalid password.")
-    else:
-        print("User not found.")
-    return None, None
+    try:
+        user_id, role = authenticate(db, username, password)
+    except AuthError as e:
+        print(e)
+        return None, None
+    print(f"Login successful. Welcome, {username}!")
+    return user_id, role
 
 if __name__ == "__main__":
     db = Database()
@@ -0,0 +1,92 @@
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobCancelled(Exception):
+    """ Фоновая задача остановлена по запросу отмены. """
+
+
+class WorkerSignals(QObject):
+    """ Сигналы фоновой задачи (доставляются в поток получателя, обычно - поток интерфейса). """
+    finished = pyqtSignal(object)  # Результат функции
+    failed = pyqtSignal(object)    # Исключение
+    progress = pyqtSignal(object)  # Ход выполнения (формат определяет задача)
+    cancelled = pyqtSignal()
+
+
+class Job:
+    """
+    Связь долгой фоновой задачи с интерфейсом: задача сообщает о ходе выполнения через report()
+    и в этих же точках проверяет, не запрошена ли отмена.
+    """
+
+    def __init__(self, signals):
+        self.signals = signals
+        self._cancel_requested = threading.Event()
+
+    def cancel(self):
+        """ Запрашивает отмену; задача остановится в ближайшей точке проверки. """
+        self._cancel_requested.set()
+
+    def is_cancelled(self):
+        return self._cancel_requested.is_set()
+
+    def check(self):
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+
+    def report(self, status):
+        self.check()
+        self.signals.progress.emit(status)
+
+
+class Worker(QRunnable):
+    """ Выполняет функцию в пуле потоков Qt и сообщает результат через сигналы. """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except JobCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+def run_in_background(fn, *args, on_finished=None, on_failed=None, **kwargs):
+    """
+    Запускает fn(*args, **kwargs) в глобальном пуле потоков.
+    Обработчики подключаются до запуска, чтобы не потерять сигнал быстро завершившейся задачи.
+    :return: WorkerSignals задачи; вызывающий должен хранить ссылку на них до получения результата.
+    """
+    worker = Worker(fn, *args, **kwargs)
+    _start(worker, finished=on_finished, failed=on_failed)
+    return worker.signals
+
+
+def start_job(fn, *args, on_finished=None, on_failed=None, on_progress=None, on_cancelled=None, **kwargs):
+    """
+    Запускает отменяемую задачу fn(job, *args, **kwargs) в глобальном пуле потоков.
+    :return: Job задачи - для отмены; вызывающий должен хранить ссылку на него до завершения задачи.
+    """
+    worker = Worker(fn, *args, **kwargs)
+    job = Job(worker.signals)
+    worker.args = (job,) + worker.args
+    _start(worker, finished=on_finished, failed=on_failed, progress=on_progress, cancelled=on_cancelled)
+    return job
+
+
+def _start(worker, **handlers):
+    for name, handler in handlers.items():
+        if handler is not None:
+            getattr(worker.signals, name).connect(handler)
+    QThreadPool.globalInstance().start(worker)